@@ -3,18 +3,87 @@
 재무제표 시각화 웹 애플리케이션
 """
 
-from flask import Flask, render_template, request, jsonify
-import json
+import os
+
+if os.environ.get('FLASK_ENV') == 'production':
+    # requests 호출이 greenlet을 양보하도록 다른 모듈을 불러오기 전에 패치
+    from gevent import monkey
+    monkey.patch_all()
+    # Gemini 클라이언트는 gRPC를 쓰므로 gRPC도 gevent 허브에 맞춰야 워커 전체가 멈추지 않음
+    try:
+        import grpc.experimental.gevent as grpc_gevent
+        grpc_gevent.init_gevent()
+    except ImportError:
+        pass
+
+import datetime
+import functools
+import threading
+import numpy as np
+from cachetools import TTLCache
+from flask import Flask, Response, render_template, request
+from flask_compress import Compress
+from orjson_response import orjson_response
 from db_setup import CorpCodeDBManager
 from dart_financial_api import DartFinancialAPI
-from financial_analyzer import FinancialAnalyzer
+from financial_analyzer import get_analyzer
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 
+# 500바이트 이상의 JSON/HTML 응답 압축 (brotli 우선, gzip 대체)
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/html']
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_BR_LEVEL'] = 4
+app.config['COMPRESS_LEVEL'] = 6
+app.config['COMPRESS_MIN_SIZE'] = 500
+Compress(app)
+
 # 전역 객체 초기화
 db_manager = CorpCodeDBManager()
 
+@functools.lru_cache(maxsize=1)
+def get_dart_api():
+    """DartFinancialAPI 싱글톤 반환 (HTTP 세션 재사용)"""
+    return DartFinancialAPI()
+
+# 공시된 재무데이터는 바뀌지 않으므로 성공한 조회 결과를 프로세스 내에 캐시
+# (캐시된 결과는 요청 간에 공유되므로 호출한 쪽에서 수정하면 안 됨)
+_fin_cache = TTLCache(maxsize=4096, ttl=3600)
+_fin_cache_lock = threading.Lock()
+
+def fetch_financial_summary(api, corp_code, year, report_type):
+    """재무데이터 조회 (성공 결과는 차트 데이터와 함께 캐시)"""
+    key = ('summary', corp_code, year, report_type)
+    with _fin_cache_lock:
+        result = _fin_cache.get(key)
+    
+    if result is None:
+        # 실패 시 자동으로 다른 연도/보고서 시도
+        result = api.get_financial_summary_with_fallback(corp_code, year, report_type)
+        if result['success']:
+            # 차트 데이터는 summary만으로 결정되므로 함께 저장
+            result['chart_data'] = prepare_chart_data(result['summary'])
+            with _fin_cache_lock:
+                _fin_cache[key] = result
+    
+    return result
+
+def fetch_multi_year_data(api, corp_code, start_year, end_year, report_type):
+    """다년도 재무데이터 조회 (성공 결과는 차트 데이터와 함께 캐시)"""
+    key = ('multi_year', corp_code, start_year, end_year, report_type)
+    with _fin_cache_lock:
+        result = _fin_cache.get(key)
+    
+    if result is None:
+        result = api.get_multi_year_data(corp_code, start_year, end_year, report_type)
+        if result['success']:
+            result['chart_data'] = prepare_multi_year_chart_data(result['data'])
+            with _fin_cache_lock:
+                _fin_cache[key] = result
+    
+    return result
+
 @app.route('/')
 def index():
     """메인 페이지"""
@@ -26,19 +95,19 @@ def search_companies():
     try:
         query = request.args.get('q', '').strip()
         if not query:
-            return jsonify({'success': False, 'error': '검색어를 입력해주세요.'})
+            return orjson_response({'success': False, 'error': '검색어를 입력해주세요.'})
         
         # 회사 검색
         companies = db_manager.search_companies(query, limit=20)
         
-        return jsonify({
+        return orjson_response({
             'success': True,
             'companies': companies,
             'total': len(companies)
         })
     
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        return orjson_response({'success': False, 'error': str(e)})
 
 @app.route('/api/company/<corp_code>')
 def get_company_info(corp_code):
@@ -46,15 +115,15 @@ def get_company_info(corp_code):
     try:
         company = db_manager.get_company_by_code(corp_code)
         if not company:
-            return jsonify({'success': False, 'error': '회사를 찾을 수 없습니다.'})
+            return orjson_response({'success': False, 'error': '회사를 찾을 수 없습니다.'})
         
-        return jsonify({
+        return orjson_response({
             'success': True,
             'company': company
         })
     
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        return orjson_response({'success': False, 'error': str(e)})
 
 @app.route('/api/financial-data/<corp_code>')
 def get_financial_data(corp_code):
@@ -65,32 +134,29 @@ def get_financial_data(corp_code):
         
         # API 키 확인
         try:
-            api = DartFinancialAPI()
+            api = get_dart_api()
         except ValueError as e:
-            return jsonify({
+            return orjson_response({
                 'success': False, 
                 'error': 'API 키가 설정되지 않았습니다. .env 파일에 DART_API_KEY를 설정해주세요.'
             })
         
         # 재무데이터 조회 (실패 시 자동으로 다른 연도/보고서 시도)
-        result = api.get_financial_summary_with_fallback(corp_code, year, report_type)
+        result = fetch_financial_summary(api, corp_code, year, report_type)
         
         if result['success']:
-            summary = result['summary']
-            
-            # 차트용 데이터 변환
-            chart_data = prepare_chart_data(summary)
-            
-            return jsonify({
+            # 지난 회계연도 데이터는 바뀌지 않으므로 브라우저/프록시 캐시 허용
+            past_year = year.isdigit() and int(year) < datetime.date.today().year
+            return orjson_response({
                 'success': True,
-                'summary': summary,
-                'chart_data': chart_data
-            })
+                'summary': result['summary'],
+                'chart_data': result['chart_data']
+            }, max_age=86400 if past_year else None)
         else:
-            return jsonify(result)
+            return orjson_response(result)
     
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        return orjson_response({'success': False, 'error': str(e)})
 
 @app.route('/api/multi-year-data/<corp_code>')
 def get_multi_year_data(corp_code):
@@ -102,31 +168,28 @@ def get_multi_year_data(corp_code):
         
         # API 키 확인
         try:
-            api = DartFinancialAPI()
+            api = get_dart_api()
         except ValueError as e:
-            return jsonify({
+            return orjson_response({
                 'success': False, 
                 'error': 'API 키가 설정되지 않았습니다. .env 파일에 DART_API_KEY를 설정해주세요.'
             })
         
         # 다년도 데이터 조회
-        result = api.get_multi_year_data(corp_code, start_year, end_year, report_type)
+        result = fetch_multi_year_data(api, corp_code, start_year, end_year, report_type)
         
         if result['success']:
-            # 차트용 데이터 변환
-            chart_data = prepare_multi_year_chart_data(result['data'])
-            
-            return jsonify({
+            return orjson_response({
                 'success': True,
                 'data': result['data'],
-                'chart_data': chart_data,
+                'chart_data': result['chart_data'],
                 'errors': result.get('errors', [])
             })
         else:
-            return jsonify(result)
+            return orjson_response(result)
     
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        return orjson_response({'success': False, 'error': str(e)})
 
 @app.route('/api/analyze-financial/<corp_code>')
 def analyze_financial(corp_code):
@@ -138,35 +201,35 @@ def analyze_financial(corp_code):
         # 회사 정보 조회
         company = db_manager.get_company_by_code(corp_code)
         if not company:
-            return jsonify({'success': False, 'error': '회사를 찾을 수 없습니다.'})
+            return orjson_response({'success': False, 'error': '회사를 찾을 수 없습니다.'})
         
         # DART API로 재무데이터 조회
         try:
-            dart_api = DartFinancialAPI()
+            dart_api = get_dart_api()
         except ValueError as e:
-            return jsonify({
+            return orjson_response({
                 'success': False, 
                 'error': 'DART API 키가 설정되지 않았습니다.'
             })
         
-        financial_result = dart_api.get_financial_summary_with_fallback(corp_code, year, report_type)
+        financial_result = fetch_financial_summary(dart_api, corp_code, year, report_type)
         
         if not financial_result['success']:
-            return jsonify({
+            return orjson_response({
                 'success': False, 
                 'error': f'재무데이터 조회 실패: {financial_result["error"]}'
             })
         
         # Gemini AI로 분석
         try:
-            analyzer = FinancialAnalyzer()
+            analyzer = get_analyzer()
         except ValueError as e:
-            return jsonify({
+            return orjson_response({
                 'success': False, 
                 'error': 'Gemini API 키가 설정되지 않았습니다. .env 파일에 GEMINI_API_KEY를 설정해주세요.'
             })
         except ImportError as e:
-            return jsonify({
+            return orjson_response({
                 'success': False, 
                 'error': 'google-generativeai 패키지가 필요합니다. pip install google-generativeai로 설치해주세요.'
             })
@@ -177,7 +240,7 @@ def analyze_financial(corp_code):
         )
         
         if analysis_result['success']:
-            return jsonify({
+            return orjson_response({
                 'success': True,
                 'analysis': analysis_result['analysis'],
                 'company_name': company['corp_name'],
@@ -185,10 +248,10 @@ def analyze_financial(corp_code):
                 'report_type': report_type
             })
         else:
-            return jsonify(analysis_result)
+            return orjson_response(analysis_result)
     
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        return orjson_response({'success': False, 'error': str(e)})
 
 @app.route('/api/analyze-trends/<corp_code>')
 def analyze_trends(corp_code):
@@ -201,35 +264,35 @@ def analyze_trends(corp_code):
         # 회사 정보 조회
         company = db_manager.get_company_by_code(corp_code)
         if not company:
-            return jsonify({'success': False, 'error': '회사를 찾을 수 없습니다.'})
+            return orjson_response({'success': False, 'error': '회사를 찾을 수 없습니다.'})
         
         # DART API로 다년도 데이터 조회
         try:
-            dart_api = DartFinancialAPI()
+            dart_api = get_dart_api()
         except ValueError as e:
-            return jsonify({
+            return orjson_response({
                 'success': False, 
                 'error': 'DART API 키가 설정되지 않았습니다.'
             })
         
-        multi_year_result = dart_api.get_multi_year_data(corp_code, start_year, end_year, report_type)
+        multi_year_result = fetch_multi_year_data(dart_api, corp_code, start_year, end_year, report_type)
         
         if not multi_year_result['success']:
-            return jsonify({
+            return orjson_response({
                 'success': False, 
                 'error': f'다년도 데이터 조회 실패: {multi_year_result.get("error", "알 수 없는 오류")}'
             })
         
         # Gemini AI로 추이 분석
         try:
-            analyzer = FinancialAnalyzer()
+            analyzer = get_analyzer()
         except ValueError as e:
-            return jsonify({
+            return orjson_response({
                 'success': False, 
                 'error': 'Gemini API 키가 설정되지 않았습니다.'
             })
         except ImportError as e:
-            return jsonify({
+            return orjson_response({
                 'success': False, 
                 'error': 'google-generativeai 패키지가 필요합니다.'
             })
@@ -240,7 +303,7 @@ def analyze_trends(corp_code):
         )
         
         if trend_analysis_result['success']:
-            return jsonify({
+            return orjson_response({
                 'success': True,
                 'trend_analysis': trend_analysis_result['trend_analysis'],
                 'company_name': company['corp_name'],
@@ -248,62 +311,54 @@ def analyze_trends(corp_code):
                 'report_type': report_type
             })
         else:
-            return jsonify(trend_analysis_result)
+            return orjson_response(trend_analysis_result)
     
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        return orjson_response({'success': False, 'error': str(e)})
 
 def prepare_chart_data(summary):
     """단일 연도 차트 데이터 준비"""
-    chart_data = {
-        'balance_sheet': {
-            'labels': [],
-            'current_data': [],
-            'previous_data': []
-        },
-        'income_statement': {
-            'labels': [],
-            'current_data': [],
-            'previous_data': []
-        }
-    }
-    
-    # 재무상태표 데이터
-    bs = summary.get('balance_sheet', {})
-    for key, value in bs.items():
-        if isinstance(value, dict) and 'account' in value:
-            chart_data['balance_sheet']['labels'].append(value['account'])
-            chart_data['balance_sheet']['current_data'].append(value.get('current', 0))
-            chart_data['balance_sheet']['previous_data'].append(value.get('previous', 0))
+    chart_data = {}
     
-    # 손익계산서 데이터
-    is_data = summary.get('income_statement', {})
-    for key, value in is_data.items():
-        if isinstance(value, dict) and 'account' in value:
-            chart_data['income_statement']['labels'].append(value['account'])
-            chart_data['income_statement']['current_data'].append(value.get('current', 0))
-            chart_data['income_statement']['previous_data'].append(value.get('previous', 0))
+    # 재무상태표, 손익계산서 데이터
+    for section in ('balance_sheet', 'income_statement'):
+        rows = [
+            (value['account'], value.get('current', 0), value.get('previous', 0))
+            for value in summary.get(section, {}).values()
+            if isinstance(value, dict) and 'account' in value
+        ]
+        labels, current_data, previous_data = map(list, zip(*rows)) if rows else ([], [], [])
+        chart_data[section] = {
+            'labels': labels,
+            'current_data': current_data,
+            'previous_data': previous_data
+        }
     
     return chart_data
 
 def prepare_multi_year_chart_data(data):
-    """다년도 차트 데이터 준비"""
+    """다년도 차트 데이터 준비 (금액 시리즈는 orjson이 직접 직렬화하는 int64 배열)"""
+    labels = [str(year) for year in data['years']]
+    
+    def series(key):
+        return np.asarray(data[key], dtype=np.int64)
+    
     return {
-        'years': data['years'],
+        'years': list(data['years']),
         'revenue_trend': {
-            'labels': [str(year) for year in data['years']],
-            'data': data['revenue']
+            'labels': labels,
+            'data': series('revenue')
         },
         'profit_trend': {
-            'labels': [str(year) for year in data['years']],
-            'operating_profit': data['operating_profit'],
-            'net_profit': data['net_profit']
+            'labels': labels,
+            'operating_profit': series('operating_profit'),
+            'net_profit': series('net_profit')
         },
         'balance_trend': {
-            'labels': [str(year) for year in data['years']],
-            'assets': data['total_assets'],
-            'liabilities': data['total_liabilities'],
-            'equity': data['total_equity']
+            'labels': labels,
+            'assets': series('total_assets'),
+            'liabilities': series('total_liabilities'),
+            'equity': series('total_equity')
         }
     }
 
@@ -317,16 +372,21 @@ def dashboard(corp_code):
     
     return render_template('dashboard.html', company=company)
 
+@functools.lru_cache(maxsize=None)
+def render_error_page(template_name):
+    """에러 페이지는 내용이 고정이므로 한 번만 렌더링해서 재사용"""
+    return render_template(template_name)
+
 @app.errorhandler(404)
 def not_found(error):
-    return render_template('404.html'), 404
+    return Response(render_error_page('404.html'), status=404, mimetype='text/html')
 
 @app.errorhandler(500)
 def internal_error(error):
-    return render_template('500.html'), 500
+    return Response(render_error_page('500.html'), status=500, mimetype='text/html')
 
 if __name__ == '__main__':
-    import os
+    # 로컬 개발용 서버 (배포 환경은 gunicorn -c gunicorn_conf.py app:app)
     
     # 데이터베이스 초기화 확인
     try:
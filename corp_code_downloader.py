@@ -3,63 +3,91 @@
 Open DART API를 사용하여 회사코드 파일을 다운로드하는 스크립트
 """
 
+import io
+import logging
 import os
 import requests
 import zipfile
-import xml.etree.ElementTree as ET
 from dotenv import load_dotenv
+from db_setup import CorpCodeDBManager, iter_corp_elements
 
 # 환경변수 로드
 load_dotenv()
 
 class DartCorpCodeDownloader:
-    def __init__(self):
+    def __init__(self, db_manager=None):
         self.api_key = os.getenv('DART_API_KEY')
         self.base_url = "https://opendart.fss.or.kr/api/corpCode.xml"
         
         if not self.api_key or self.api_key == 'your_dart_api_key_here':
             raise ValueError("DART_API_KEY가 .env 파일에 설정되지 않았습니다.")
+        
+        # 회사 검색은 XML 재파싱 대신 SQLite FTS 인덱스를 사용
+        self.db_manager = db_manager or CorpCodeDBManager()
+        
+        # 반복 다운로드 시 연결을 재사용하는 HTTP 세션
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': 'fs-app/1.0'})
     
-    def download_corp_code(self, output_dir="./data"):
+    def download_corp_code(self, output_dir="./data", save_files=False):
         """
         회사코드 파일을 다운로드합니다.
         
         Args:
             output_dir (str): 다운로드된 파일을 저장할 디렉토리
+            save_files (bool): True이면 ZIP/XML 파일을 디스크에도 저장
         
         Returns:
             dict: 다운로드 결과 정보
         """
         try:
-            # 출력 디렉토리 생성
-            os.makedirs(output_dir, exist_ok=True)
-            
             # API 요청
             params = {
                 'crtfc_key': self.api_key
             }
             
             print("회사코드 파일을 다운로드 중...")
-            response = requests.get(self.base_url, params=params)
-            
-            if response.status_code != 200:
-                return {
-                    'success': False,
-                    'error': f'HTTP 오류: {response.status_code}'
-                }
-            
-            # ZIP 파일로 저장
-            zip_filename = os.path.join(output_dir, "CORPCODE.zip")
-            with open(zip_filename, 'wb') as f:
-                f.write(response.content)
-            
-            print(f"ZIP 파일 저장 완료: {zip_filename}")
+            # 스트리밍 응답은 어느 경로로 끝나든 닫아야 연결이 풀로 돌아감
+            with self.session.get(self.base_url, params=params, stream=True, timeout=30) as response:
+                if response.status_code != 200:
+                    return {
+                        'success': False,
+                        'error': f'HTTP 오류: {response.status_code}'
+                    }
+                
+                # ZIP 데이터를 메모리에 보관
+                buffer = io.BytesIO()
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    buffer.write(chunk)
+            buffer.seek(0)
+            
+            zip_filename = None
+            xml_filename = None
+            
+            if save_files:
+                # ZIP 파일로 저장
+                os.makedirs(output_dir, exist_ok=True)
+                zip_filename = os.path.join(output_dir, "CORPCODE.zip")
+                with open(zip_filename, 'wb') as f:
+                    f.write(buffer.getvalue())
+                
+                print(f"ZIP 파일 저장 완료: {zip_filename}")
+                
+                # ZIP 파일 압축 해제
+                xml_filename = self.extract_zip(zip_filename, output_dir)
             
-            # ZIP 파일 압축 해제
-            xml_filename = self.extract_zip(zip_filename, output_dir)
+            # 임시 XML 파일 없이 ZIP 안의 XML을 바로 파싱
+            with zipfile.ZipFile(buffer) as zf:
+                xml_name = next((n for n in zf.namelist() if n.endswith('.xml')), None)
+                if xml_name is None:
+                    raise ValueError("ZIP 파일에서 XML 파일을 찾을 수 없습니다.")
+                
+                with zf.open(xml_name) as xml_fp:
+                    corp_info = self.parse_corp_xml(xml_fp)
             
-            # XML 파일 파싱하여 기본 정보 출력
-            corp_info = self.parse_corp_xml(xml_filename)
+            # 검색용 데이터베이스에 일괄 저장
+            saved_count = self.db_manager.bulk_upsert(corp_info['all_data'])
+            print(f"데이터베이스 저장 완료: {saved_count:,}개 회사")
             
             return {
                 'success': True,
@@ -91,24 +119,24 @@ class DartCorpCodeDownloader:
         except Exception as e:
             raise Exception(f"ZIP 파일 압축 해제 실패: {str(e)}")
     
-    def parse_corp_xml(self, xml_filename, sample_count=5):
-        """XML 파일을 파싱하여 회사 정보를 추출합니다."""
+    def parse_corp_xml(self, xml_source, sample_count=5):
+        """XML 파일(경로 또는 파일 객체)을 파싱하여 회사 정보를 추출합니다."""
         try:
-            tree = ET.parse(xml_filename)
-            root = tree.getroot()
-            
             companies = []
             total_count = 0
             
-            for list_elem in root.findall('list'):
-                corp_code = list_elem.find('corp_code').text if list_elem.find('corp_code') is not None else ''
-                corp_name = list_elem.find('corp_name').text if list_elem.find('corp_name') is not None else ''
-                stock_code = list_elem.find('stock_code').text if list_elem.find('stock_code') is not None else ''
-                modify_date = list_elem.find('modify_date').text if list_elem.find('modify_date') is not None else ''
+            # 전체 트리를 만들지 않고 <list> 단위로 스트리밍 파싱
+            for elem in iter_corp_elements(xml_source):
+                corp_code = elem.findtext('corp_code', '')
+                corp_name = elem.findtext('corp_name', '')
+                corp_eng_name = elem.findtext('corp_eng_name', '')
+                stock_code = elem.findtext('stock_code', '')
+                modify_date = elem.findtext('modify_date', '')
                 
                 companies.append({
                     'corp_code': corp_code,
                     'corp_name': corp_name,
+                    'corp_eng_name': corp_eng_name,
                     'stock_code': stock_code,
                     'modify_date': modify_date
                 })
@@ -128,37 +156,18 @@ class DartCorpCodeDownloader:
         except Exception as e:
             raise Exception(f"XML 파일 파싱 실패: {str(e)}")
     
-    def search_company(self, xml_filename, company_name):
+    def search_company(self, company_name, limit=20):
         """특정 회사명으로 회사 정보를 검색합니다."""
         try:
-            tree = ET.parse(xml_filename)
-            root = tree.getroot()
-            
-            results = []
-            
-            for list_elem in root.findall('list'):
-                corp_name = list_elem.find('corp_name').text if list_elem.find('corp_name') is not None else ''
-                
-                if company_name.lower() in corp_name.lower():
-                    corp_code = list_elem.find('corp_code').text if list_elem.find('corp_code') is not None else ''
-                    stock_code = list_elem.find('stock_code').text if list_elem.find('stock_code') is not None else ''
-                    modify_date = list_elem.find('modify_date').text if list_elem.find('modify_date') is not None else ''
-                    
-                    results.append({
-                        'corp_code': corp_code,
-                        'corp_name': corp_name,
-                        'stock_code': stock_code,
-                        'modify_date': modify_date
-                    })
-            
-            return results
-            
+            return self.db_manager.search_companies(company_name, limit=limit)
         except Exception as e:
             raise Exception(f"회사 검색 실패: {str(e)}")
 
 
 def main():
     """메인 실행 함수"""
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
     try:
         downloader = DartCorpCodeDownloader()
         
@@ -171,16 +180,16 @@ def main():
         
         if result['success']:
             print(f"\n✅ 다운로드 완료!")
-            print(f"📁 ZIP 파일: {result['zip_file']}")
-            print(f"📄 XML 파일: {result['xml_file']}")
+            if result['zip_file']:
+                print(f"📁 ZIP 파일: {result['zip_file']}")
+                print(f"📄 XML 파일: {result['xml_file']}")
             print(f"🏢 총 회사 수: {result['total_companies']:,}개")
             print("\n📊 샘플 회사 정보:")
             print("-" * 30)
             
             # 사용 예시: 특정 회사 검색
             print("\n🔍 삼성전자 검색 결과:")
-            xml_file = result['xml_file']
-            samsung_results = downloader.search_company(xml_file, "삼성전자")
+            samsung_results = downloader.search_company("삼성전자")
             
             for company in samsung_results[:3]:  # 상위 3개만 출력
                 print(f"- {company['corp_name']} (코드: {company['corp_code']}, 종목: {company['stock_code']})")
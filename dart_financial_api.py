@@ -3,23 +3,197 @@
 Open DART API를 사용한 재무정보 조회 모듈
 """
 
+import asyncio
+import datetime
 import os
+import sqlite3
+import threading
+import time
+import orjson
 import requests
-import pandas as pd
+import zstandard
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 from typing import Dict, List, Optional
 
 # 환경변수 로드
 load_dotenv()
 
+# DART 요청 타임아웃 (연결, 응답 읽기) 초
+REQUEST_TIMEOUT = (3.05, 30)
+
+# 일시적 오류(429, 5xx)는 지수 백오프 + 지터로 재시도 (Retry-After 헤더 우선)
+RETRY_POLICY = Retry(
+    total=5,
+    backoff_factor=0.5,
+    backoff_jitter=0.5,
+    status_forcelist=[429, 502, 503, 504],
+    respect_retry_after_header=True,
+    allowed_methods=['GET']
+)
+
+# 모든 인스턴스/스레드를 합쳐 동시에 보내는 DART 요청 수 상한 (요청 제한으로 인한 429 방지)
+MAX_CONCURRENT_REQUESTS = 5
+
+# 진행 중인 사업연도 응답의 캐시 유효 시간 (지난 연도는 공시 후 바뀌지 않으므로 만료 없음)
+CURRENT_YEAR_CACHE_TTL = 24 * 60 * 60
+
+# 다년도 데이터 항목 (항목명, 요약 섹션) - 항목명은 요약 섹션의 키와 같음
+MULTI_YEAR_COLUMNS = [
+    ('revenue', 'income_statement'),
+    ('operating_profit', 'income_statement'),
+    ('net_profit', 'income_statement'),
+    ('total_assets', 'balance_sheet'),
+    ('total_liabilities', 'balance_sheet'),
+    ('total_equity', 'balance_sheet'),
+]
+
+# 캐시에 저장하는 응답 본문의 zstd 압축 수준
+CACHE_COMPRESSION_LEVEL = 3
+
+# 보고서 구분(sj_div) -> 요약 섹션
+SUMMARY_SECTIONS = {'BS': 'balance_sheet', 'IS': 'income_statement'}
+
+# 계정명이 정확히 일치하는 경우의 분류 (계정명 -> (섹션, 항목))
+ACCOUNT_EXACT_RULES = {
+    '자산': ('balance_sheet', 'total_assets'),
+    '부채': ('balance_sheet', 'total_liabilities'),
+    '자본': ('balance_sheet', 'total_equity'),
+}
+
+# 정확히 일치하는 규칙이 없을 때 앞에서부터 확인하는 포함 규칙 (포함 문자열, 섹션, 항목)
+ACCOUNT_CONTAINS_RULES = [
+    ('자산총계', 'balance_sheet', 'total_assets'),
+    ('부채총계', 'balance_sheet', 'total_liabilities'),
+    ('자본총계', 'balance_sheet', 'total_equity'),
+    ('매출액', 'income_statement', 'revenue'),
+    ('영업이익', 'income_statement', 'operating_profit'),
+    ('당기순이익', 'income_statement', 'net_profit'),
+]
+
+
+def _classify_account(section: str, account_name: str) -> Optional[str]:
+    """계정명을 해당 섹션의 요약 항목 키로 분류 (해당 없으면 None)"""
+    rule = ACCOUNT_EXACT_RULES.get(account_name)
+    if rule is not None and rule[0] == section:
+        return rule[1]
+    for needle, rule_section, key in ACCOUNT_CONTAINS_RULES:
+        if rule_section == section and needle in account_name:
+            return key
+    return None
+
+
+def _to_int(amount: Optional[str]) -> int:
+    """DART 금액 문자열('1,234', '-1,234', '-', '')을 정수로 변환 (숫자가 아니면 0)"""
+    if not amount:
+        return 0
+    digits = amount.replace(',', '').strip()
+    if digits.startswith('-'):
+        return -int(digits[1:]) if digits[1:].isdecimal() else 0
+    return int(digits) if digits.isdecimal() else 0
+
+
 class DartFinancialAPI:
-    def __init__(self):
-        """Open DART 재무정보 API 클래스 초기화"""
+    # 재시도 백오프 대기도 세션 요청 안에서 일어나므로 그동안 슬롯을 유지해 전체 요청 속도가 조절됨
+    _request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+    
+    def __init__(self, cache_db_path: Optional[str] = "./data/corpcode.db"):
+        """
+        Open DART 재무정보 API 클래스 초기화
+        
+        Args:
+            cache_db_path (str): 응답 캐시를 저장할 SQLite 파일 경로 (None이면 캐시 사용 안 함)
+        """
         self.api_key = os.getenv('DART_API_KEY')
         self.base_url = "https://opendart.fss.or.kr/api"
         
         if not self.api_key or self.api_key == 'your_dart_api_key_here':
             raise ValueError("DART_API_KEY가 .env 파일에 설정되지 않았습니다.")
+        
+        # 연결 재사용을 위한 HTTP 세션 (keep-alive, 커넥션 풀, 일시적 오류 재시도)
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': 'fs-app/1.0'})
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=RETRY_POLICY)
+        self.session.mount('https://', adapter)
+        
+        # (corp_code, bsns_year, reprt_code)별 응답 캐시
+        # 연결과 zstd 압축기/해제기는 인스턴스 수명 동안 하나만 두고 잠금으로 직렬화
+        # (gevent 환경에서는 threading.local이 greenlet별이 되어 요청마다 새 연결이 열림)
+        self.cache_db_path = cache_db_path
+        self._cache_lock = threading.Lock()
+        self._conn = None
+        self._codec = None
+        if cache_db_path:
+            os.makedirs(os.path.dirname(cache_db_path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(cache_db_path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._codec = (zstandard.ZstdCompressor(level=CACHE_COMPRESSION_LEVEL), zstandard.ZstdDecompressor())
+            with self._cache_conn() as conn, conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS dart_cache (
+                        corp_code TEXT NOT NULL,
+                        bsns_year TEXT NOT NULL,
+                        reprt_code TEXT NOT NULL,
+                        fetched_at INTEGER NOT NULL,
+                        json BLOB NOT NULL,
+                        PRIMARY KEY (corp_code, bsns_year, reprt_code)
+                    )
+                ''')
+    
+    @contextmanager
+    def _cache_conn(self):
+        """공유 캐시 DB 연결을 잠금을 잡은 상태로 반환"""
+        with self._cache_lock:
+            yield self._conn
+    
+    def _read_cache(self, corp_code: str, bsns_year: str, reprt_code: str) -> Optional[bytes]:
+        """캐시된 원본 응답 반환 (없거나 만료되었으면 None)"""
+        if not self.cache_db_path:
+            return None
+        
+        try:
+            with self._cache_conn() as conn:
+                row = conn.execute('''
+                    SELECT json, fetched_at FROM dart_cache
+                    WHERE corp_code = ? AND bsns_year = ? AND reprt_code = ?
+                ''', (corp_code, bsns_year, reprt_code)).fetchone()
+        except sqlite3.Error:
+            return None
+        
+        if row is None:
+            return None
+        
+        payload, fetched_at = row
+        closed_year = bsns_year.isdigit() and int(bsns_year) < datetime.date.today().year
+        if not closed_year and time.time() - fetched_at >= CURRENT_YEAR_CACHE_TTL:
+            return None
+        
+        # 압축 저장 이전에 캐시된 항목은 원본 그대로 반환
+        if not payload.startswith(zstandard.FRAME_HEADER):
+            return payload
+        try:
+            with self._cache_lock:
+                return self._codec[1].decompress(payload)
+        except zstandard.ZstdError:
+            return None
+    
+    def _write_cache(self, corp_code: str, bsns_year: str, reprt_code: str, payload: bytes):
+        """정상 응답 원본을 zstd로 압축해서 캐시에 저장"""
+        if not self.cache_db_path:
+            return
+        
+        try:
+            with self._cache_conn() as conn, conn:
+                payload = self._codec[0].compress(payload)
+                conn.execute('''
+                    INSERT OR REPLACE INTO dart_cache (corp_code, bsns_year, reprt_code, fetched_at, json)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (corp_code, bsns_year, reprt_code, int(time.time()), payload))
+        except sqlite3.Error:
+            pass
     
     def get_financial_statements(self, corp_code: str, bsns_year: str, reprt_code: str = "11011") -> Dict:
         """
@@ -46,10 +220,17 @@ class DartFinancialAPI:
                 'reprt_code': reprt_code
             }
             
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            
-            data = response.json()
+            cached = self._read_cache(corp_code, bsns_year, reprt_code)
+            if cached is not None:
+                data = orjson.loads(cached)
+            else:
+                with self._request_slots:
+                    response = self.session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+                response.raise_for_status()
+                
+                data = orjson.loads(response.content)
+                if data.get('status') == '000':
+                    self._write_cache(corp_code, bsns_year, reprt_code, response.content)
             
             # 에러 체크
             if data.get('status') != '000':
@@ -96,37 +277,41 @@ class DartFinancialAPI:
                 'error': f"처리 오류: {str(e)}"
             }
     
-    def get_financial_summary_with_fallback(self, corp_code: str, bsns_year: str, reprt_code: str = "11011") -> Dict:
+    def get_financial_summary_with_fallback(self, corp_code: str, bsns_year: str, reprt_code: str = "11011",
+                                            include_raw: bool = False) -> Dict:
         """
         재무정보 조회 (실패 시 자동으로 다른 연도/보고서 유형 시도)
+        
+        include_raw는 get_financial_summary와 같은 의미입니다.
         """
         # 1차 시도: 요청된 연도와 보고서 유형
         result = self.get_financial_statements(corp_code, bsns_year, reprt_code)
         if result['success']:
-            return self.get_financial_summary(corp_code, bsns_year, reprt_code)
+            return self._summarize(result, corp_code, bsns_year, reprt_code, include_raw)
         
         # 013 오류인 경우 자동으로 다른 옵션들 시도
         if result.get('error_code') == '013':
-            # 2차 시도: 이전 연도들
-            for year in [str(int(bsns_year)-1), str(int(bsns_year)-2)]:
-                try:
-                    fallback_result = self.get_financial_statements(corp_code, year, reprt_code)
-                    if fallback_result['success']:
-                        print(f"✅ {year}년도 데이터로 대체 조회 성공")
-                        return self.get_financial_summary(corp_code, year, reprt_code)
-                except:
-                    continue
+            # 2차: 이전 연도들 (가까운 연도부터 하나씩 - 성공하면 나머지는 요청하지 않음)
+            # 동시에 보내면 지연은 줄지만 DART 일일 호출 한도(키당 20,000건)를 매번 최대로
+            # 쓰게 되므로, 대부분 직전 연도에서 끝나는 점을 고려해 순서대로 조회
+            for offset in (1, 2):
+                year = str(int(bsns_year) - offset)
+                fallback_result = self.get_financial_statements(corp_code, year, reprt_code)
+                if fallback_result['success']:
+                    print(f"✅ {year}년도 데이터로 대체 조회 성공")
+                    return self._summarize(fallback_result, corp_code, year, reprt_code, include_raw)
             
-            # 3차 시도: 다른 보고서 유형 (원래 연도)
+            # 3차: 다른 보고서 유형 (원래 연도)을 동시에 조회하고 앞선 유형의 성공 결과를 사용
             other_reports = ['11012', '11013', '11014'] if reprt_code == '11011' else ['11011']
-            for report in other_reports:
-                try:
-                    fallback_result = self.get_financial_statements(corp_code, bsns_year, report)
-                    if fallback_result['success']:
-                        print(f"✅ {report} 보고서로 대체 조회 성공")
-                        return self.get_financial_summary(corp_code, bsns_year, report)
-                except:
-                    continue
+            with ThreadPoolExecutor(max_workers=len(other_reports)) as executor:
+                fallback_results = list(executor.map(
+                    lambda report: self.get_financial_statements(corp_code, bsns_year, report),
+                    other_reports
+                ))
+            for report, fallback_result in zip(other_reports, fallback_results):
+                if fallback_result['success']:
+                    print(f"✅ {report} 보고서로 대체 조회 성공")
+                    return self._summarize(fallback_result, corp_code, bsns_year, report, include_raw)
         
         # 모든 시도 실패 시 원래 오류 반환
         return {
@@ -136,7 +321,8 @@ class DartFinancialAPI:
             'suggestions': result.get('suggestions', {})
         }
 
-    def get_financial_summary(self, corp_code: str, bsns_year: str, reprt_code: str = "11011") -> Dict:
+    def get_financial_summary(self, corp_code: str, bsns_year: str, reprt_code: str = "11011",
+                              include_raw: bool = False) -> Dict:
         """
         재무제표 주요 지표 요약 정보 조회
         
@@ -144,6 +330,7 @@ class DartFinancialAPI:
             corp_code (str): 회사코드
             bsns_year (str): 사업연도
             reprt_code (str): 보고서코드
+            include_raw (bool): True이면 DART 원본 항목 목록을 summary['raw_data']에 포함
         
         Returns:
             Dict: 주요 재무지표 요약
@@ -153,6 +340,11 @@ class DartFinancialAPI:
         if not result['success']:
             return result
         
+        return self._summarize(result, corp_code, bsns_year, reprt_code, include_raw)
+    
+    @staticmethod
+    def _summarize(result: Dict, corp_code: str, bsns_year: str, reprt_code: str, include_raw: bool = False) -> Dict:
+        """get_financial_statements의 성공 결과에서 주요 재무지표 요약 추출"""
         try:
             financial_data = result['data']['list']
             
@@ -160,9 +352,14 @@ class DartFinancialAPI:
             summary = {
                 'basic_info': {},
                 'balance_sheet': {},  # 재무상태표
-                'income_statement': {},  # 손익계산서
-                'raw_data': financial_data
+                'income_statement': {}  # 손익계산서
             }
+            if include_raw:
+                summary['raw_data'] = financial_data
+            
+            # 섹션별로 이미 채운 계정명 (개별재무제표가 연결재무제표 값을 덮어쓰지 않도록)
+            seen_bs = set()
+            seen_is = set()
             
             for item in financial_data:
                 account_name = item.get('account_nm', '')
@@ -183,55 +380,22 @@ class DartFinancialAPI:
                     }
                 
                 # 숫자로 변환 (콤마 제거)
-                try:
-                    current_amount = int(thstrm_amount.replace(',', '')) if thstrm_amount and thstrm_amount != '-' else 0
-                    previous_amount = int(frmtrm_amount.replace(',', '')) if frmtrm_amount and frmtrm_amount != '-' else 0
-                except:
-                    current_amount = 0
-                    previous_amount = 0
+                current_amount = _to_int(thstrm_amount)
+                previous_amount = _to_int(frmtrm_amount)
                 
                 # 연결재무제표 우선 (CFS), 없으면 개별재무제표 (OFS)
-                if fs_div == 'CFS' or (fs_div == 'OFS' and account_name not in [item['account'] for item in summary['balance_sheet'].values() if isinstance(item, dict)]):
+                seen = seen_bs if sj_div == 'BS' else seen_is
+                if fs_div == 'CFS' or (fs_div == 'OFS' and account_name not in seen):
+                    seen.add(account_name)
                     
-                    if sj_div == 'BS':  # 재무상태표
-                        if '자산총계' in account_name or '자산' == account_name:
-                            summary['balance_sheet']['total_assets'] = {
-                                'account': account_name,
-                                'current': current_amount,
-                                'previous': previous_amount
-                            }
-                        elif '부채총계' in account_name or '부채' == account_name:
-                            summary['balance_sheet']['total_liabilities'] = {
-                                'account': account_name,
-                                'current': current_amount,
-                                'previous': previous_amount
-                            }
-                        elif '자본총계' in account_name or '자본' == account_name:
-                            summary['balance_sheet']['total_equity'] = {
-                                'account': account_name,
-                                'current': current_amount,
-                                'previous': previous_amount
-                            }
-                    
-                    elif sj_div == 'IS':  # 손익계산서
-                        if '매출액' in account_name:
-                            summary['income_statement']['revenue'] = {
-                                'account': account_name,
-                                'current': current_amount,
-                                'previous': previous_amount
-                            }
-                        elif '영업이익' in account_name:
-                            summary['income_statement']['operating_profit'] = {
-                                'account': account_name,
-                                'current': current_amount,
-                                'previous': previous_amount
-                            }
-                        elif '당기순이익' in account_name:
-                            summary['income_statement']['net_profit'] = {
-                                'account': account_name,
-                                'current': current_amount,
-                                'previous': previous_amount
-                            }
+                    section = SUMMARY_SECTIONS.get(sj_div)
+                    key = _classify_account(section, account_name) if section else None
+                    if key:
+                        summary[section][key] = {
+                            'account': account_name,
+                            'current': current_amount,
+                            'previous': previous_amount
+                        }
             
             return {
                 'success': True,
@@ -257,52 +421,65 @@ class DartFinancialAPI:
         Returns:
             Dict: 다년도 재무데이터
         """
-        multi_year_data = {
-            'years': [],
-            'revenue': [],
-            'operating_profit': [],
-            'net_profit': [],
-            'total_assets': [],
-            'total_liabilities': [],
-            'total_equity': []
-        }
+        years = list(range(start_year, end_year + 1))
+        
+        # 연도별 요청을 병렬로 실행 (네트워크 대기 시간 중첩)
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(years)))) as executor:
+            # fallback 메커니즘 사용하여 더 안정적인 데이터 조회
+            results = list(executor.map(
+                lambda year: self.get_financial_summary_with_fallback(corp_code, str(year), reprt_code),
+                years
+            ))
+        
+        return self._build_multi_year_result(years, results)
+    
+    async def get_multi_year_data_async(self, corp_code: str, start_year: int, end_year: int, reprt_code: str = "11011") -> Dict:
+        """
+        여러 연도의 재무데이터 조회 (asyncio용)
+        
+        연도별 요청을 asyncio.gather로 동시에 실행합니다. 각 요청은 공유 HTTP 세션을
+        사용하는 작업 스레드에서 실행되므로 이벤트 루프를 막지 않습니다.
+        
+        Args:
+            corp_code (str): 회사코드
+            start_year (int): 시작 연도
+            end_year (int): 종료 연도
+            reprt_code (str): 보고서코드
+        
+        Returns:
+            Dict: 다년도 재무데이터 (get_multi_year_data와 같은 형식)
+        """
+        years = list(range(start_year, end_year + 1))
+        results = await asyncio.gather(*[
+            asyncio.to_thread(self.get_financial_summary_with_fallback, corp_code, str(year), reprt_code)
+            for year in years
+        ])
+        return self._build_multi_year_result(years, results)
+    
+    @staticmethod
+    def _build_multi_year_result(years: List[int], results: List[Dict]) -> Dict:
+        """
+        연도별 조회 결과를 다년도 데이터 (항목별 리스트)로 정리
         
+        실패한 연도는 빠지므로 길이를 미리 알 수 없고, 결과는 JSON과 프롬프트로만 쓰이므로
+        미리 할당한 numpy 배열 대신 리스트에 바로 추가합니다 (연도 수가 10개 안팎).
+        """
+        multi_year_data = {'years': []}
+        for column, section in MULTI_YEAR_COLUMNS:
+            multi_year_data[column] = []
         errors = []
         
-        for year in range(start_year, end_year + 1):
-            # fallback 메커니즘 사용하여 더 안정적인 데이터 조회
-            result = self.get_financial_summary_with_fallback(corp_code, str(year), reprt_code)
-            
+        for year, result in zip(years, results):
             if result['success']:
                 summary = result['summary']
                 multi_year_data['years'].append(year)
-                
-                # 손익계산서 데이터
-                multi_year_data['revenue'].append(
-                    summary['income_statement'].get('revenue', {}).get('current', 0)
-                )
-                multi_year_data['operating_profit'].append(
-                    summary['income_statement'].get('operating_profit', {}).get('current', 0)
-                )
-                multi_year_data['net_profit'].append(
-                    summary['income_statement'].get('net_profit', {}).get('current', 0)
-                )
-                
-                # 재무상태표 데이터
-                multi_year_data['total_assets'].append(
-                    summary['balance_sheet'].get('total_assets', {}).get('current', 0)
-                )
-                multi_year_data['total_liabilities'].append(
-                    summary['balance_sheet'].get('total_liabilities', {}).get('current', 0)
-                )
-                multi_year_data['total_equity'].append(
-                    summary['balance_sheet'].get('total_equity', {}).get('current', 0)
-                )
+                for column, section in MULTI_YEAR_COLUMNS:
+                    multi_year_data[column].append(summary[section].get(column, {}).get('current', 0))
             else:
                 errors.append(f"{year}년: {result['error']}")
         
         return {
-            'success': len(multi_year_data['years']) > 0,
+            'success': bool(multi_year_data['years']),
             'data': multi_year_data,
             'errors': errors
         }
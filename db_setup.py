@@ -3,10 +3,69 @@
 CORPCODE.xml 파일을 SQLite 데이터베이스로 변환하는 스크립트
 """
 
+import heapq
+import io
+import logging
 import sqlite3
-import xml.etree.ElementTree as ET
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
 import os
 from pathlib import Path
+from cachetools import TTLCache, cached
+
+# lxml(libxml2)이 있으면 XML 파싱에 사용하고, 없으면 표준 라이브러리로 대체
+try:
+    from lxml import etree as ET
+    HAS_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAS_LXML = False
+
+logger = logging.getLogger(__name__)
+
+# XML 적재 시 executemany 한 번에 넣을 행 수
+XML_INSERT_BATCH_SIZE = 5000
+
+# companies 테이블 검색용 인덱스 (이름, 정의)
+# corp_code는 UNIQUE 제약이 만드는 자동 인덱스를 사용
+COMPANY_INDEXES = [
+    ('idx_corp_name', 'CREATE INDEX IF NOT EXISTS idx_corp_name ON companies(corp_name)'),
+]
+
+# 검색 캐시와 글자 역색인의 유효 시간 (초) - 다른 프로세스가 DB를 재적재한 경우 반영
+SEARCH_CACHE_TTL = 3600
+
+# 글자 역색인에 보관하는 회사 정보 열 (dict보다 작은 튜플로 보관하고 반환할 때 dict로 변환)
+CHAR_INDEX_COLUMNS = ('corp_code', 'corp_name', 'corp_eng_name', 'stock_code', 'modify_date')
+
+# 두 글자 검색에서 글자 역색인을 쓰는 최대 후보 수 (더 많으면 파이썬 필터링이 LIKE보다 느림)
+CHAR_INDEX_MAX_BUCKET = 2000
+
+# 예전 버전에서 만들던 인덱스 (자동 인덱스와 중복되거나 조회에 쓰이지 않음)
+OBSOLETE_INDEXES = ['idx_corp_code', 'idx_stock_code']
+
+
+def iter_corp_elements(xml_source):
+    """
+    CORPCODE.xml의 <list> 요소를 하나씩 반환 (처리가 끝난 요소는 메모리에서 해제)
+    
+    Args:
+        xml_source: XML 파일 경로 또는 파일 객체
+    """
+    if HAS_LXML:
+        for event, elem in ET.iterparse(xml_source, events=('end',), tag='list'):
+            yield elem
+            elem.clear()
+            # 이미 처리한 형제 요소가 루트에 쌓이지 않도록 정리
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    else:
+        for event, elem in ET.iterparse(xml_source, events=('end',)):
+            if elem.tag == 'list':
+                yield elem
+                elem.clear()
 
 class CorpCodeDBManager:
     def __init__(self, db_path="./data/corpcode.db"):
@@ -17,8 +76,29 @@ class CorpCodeDBManager:
             db_path (str): SQLite 데이터베이스 파일 경로
         """
         self.db_path = db_path
+        # 자동완성으로 같은 검색어가 반복되므로 결과를 캐시 (재적재 시 초기화,
+        # 다른 프로세스에서 재적재한 경우를 위해 1시간 후 만료)
+        self._search_cache = TTLCache(maxsize=512, ttl=SEARCH_CACHE_TTL)
+        self._search_cache_lock = threading.Lock()
+        self._search_cached = cached(self._search_cache, lock=self._search_cache_lock)(self._search_companies)
+        # 대시보드/분석 API가 같은 회사를 반복 조회하므로 회사코드 조회도 캐시
+        # (검색 캐시와 같은 TTL, 없는 회사는 재적재 후 바로 보이도록 캐시하지 않음)
+        self._company_cache = TTLCache(maxsize=2048, ttl=SEARCH_CACHE_TTL)
+        # 한두 글자 검색용 메모리 역색인 (첫 사용 시 생성, DB 파일이 바뀐 경우에만 다시 생성)
+        self._char_index = None
+        self._char_index_built_at = 0.0
+        self._char_index_version = None
+        self._char_index_rebuilding = False
+        self._char_index_lock = threading.Lock()
         self.ensure_data_dir()
         self.init_database()
+        # 조회용 연결은 인스턴스 수명 동안 하나만 열어 공유 (gevent 환경에서는
+        # threading.local이 greenlet별로 바뀌어 요청마다 새 연결이 열리므로 잠금으로 직렬화)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA cache_size=-20000')
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
     
     def ensure_data_dir(self):
         """data 디렉터리가 없으면 생성"""
@@ -44,70 +124,292 @@ class CorpCodeDBManager:
             ''')
             
             # 검색 성능을 위한 인덱스 생성
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_corp_name ON companies(corp_name)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_corp_code ON companies(corp_code)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_stock_code ON companies(stock_code)')
+            self._create_indexes(cursor)
+            for index_name in OBSOLETE_INDEXES:
+                cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
+            
+            # 부분 문자열 검색용 FTS5 trigram 인덱스 (companies 테이블을 외부 콘텐츠로 사용)
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'companies_fts'")
+            fts_exists = cursor.fetchone() is not None
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS companies_fts USING fts5(
+                    corp_name,
+                    corp_eng_name,
+                    content='companies',
+                    content_rowid='id',
+                    tokenize='trigram'
+                )
+            ''')
+            
+            # 기존 데이터베이스에 FTS 테이블을 새로 만든 경우 인덱스 채우기
+            if not fts_exists:
+                self._rebuild_fts(cursor)
             
             conn.commit()
-            print("✅ 데이터베이스 테이블 초기화 완료")
+            logger.info("✅ 데이터베이스 테이블 초기화 완료")
+    
+    @contextmanager
+    def _get_conn(self):
+        """공유 조회용 연결을 잠금을 잡은 상태로 반환"""
+        with self._lock:
+            yield self._conn
+    
+    @staticmethod
+    def _create_indexes(cursor):
+        """companies 테이블 인덱스 생성"""
+        for _, create_sql in COMPANY_INDEXES:
+            cursor.execute(create_sql)
+    
+    @staticmethod
+    def _drop_indexes(cursor):
+        """대량 적재 전 인덱스 삭제 (행마다 인덱스를 갱신하지 않고 적재 후 한 번에 생성)"""
+        for index_name, _ in COMPANY_INDEXES:
+            cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
+    
+    @contextmanager
+    def _bulk_load(self):
+        """대량 적재용 연결 (fsync 생략, 임시 데이터는 메모리, 큰 페이지 캐시)"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA cache_size=-65536')
+            with conn:
+                yield conn
+        finally:
+            # journal_mode 외의 설정은 연결 단위이므로 연결을 닫으면 기본값으로 돌아감
+            conn.close()
     
-    def xml_to_database(self, xml_path="./data/CORPCODE.xml"):
+    def _invalidate_search_cache(self):
+        """데이터 재적재 후 검색 캐시와 글자 인덱스 초기화"""
+        with self._search_cache_lock:
+            self._search_cache.clear()
+            self._company_cache.clear()
+        self._char_index = None
+    
+    def _db_version(self):
+        """DB 파일(WAL 포함)의 수정 시각 - 다른 프로세스가 재적재했는지 판단하는 데 사용"""
+        version = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            try:
+                version.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                version.append(None)
+        return tuple(version)
+    
+    def _get_char_index(self):
+        """
+        짧은 검색어용 역색인 반환 (글자 -> 그 글자를 포함한 회사 튜플 목록)
+        
+        각 목록은 search_companies의 SQL과 같은 순서(정확히 일치, 이름 길이, 이름)로 정렬되어
+        있어 LIKE 전체 스캔 없이 앞부분만 잘라서 반환할 수 있습니다.
+        SEARCH_CACHE_TTL마다 DB 파일이 바뀌었는지 확인하고, 바뀐 경우 기존 인덱스를 계속
+        반환하면서 백그라운드에서 다시 만듭니다 (요청이 수 초짜리 재생성을 기다리지 않도록).
+        """
+        index = self._char_index
+        if index is not None and time.monotonic() - self._char_index_built_at < SEARCH_CACHE_TTL:
+            return index
+        
+        with self._char_index_lock:
+            # 잠금을 기다리는 동안 다른 스레드가 이미 새로 만든 경우
+            index = self._char_index
+            if index is not None and time.monotonic() - self._char_index_built_at < SEARCH_CACHE_TTL:
+                return index
+            
+            if index is None:
+                # 처음이거나 재적재로 초기화된 경우에는 돌려줄 인덱스가 없으므로 바로 생성
+                index, version = self._build_char_index()
+                self._set_char_index(index, version)
+            elif self._db_version() == self._char_index_version:
+                # DB가 그대로면 다시 만들 필요 없이 다음 확인 시각만 미룸
+                self._char_index_built_at = time.monotonic()
+            elif not self._char_index_rebuilding:
+                self._char_index_rebuilding = True
+                threading.Thread(target=self._rebuild_char_index, daemon=True).start()
+        return index
+    
+    def _rebuild_char_index(self):
+        """백그라운드 재생성 (끝날 때까지 기존 인덱스를 계속 사용)"""
+        try:
+            with self._char_index_lock:
+                stale = self._char_index
+            index, version = self._build_char_index()
+            with self._char_index_lock:
+                # 재생성 중에 재적재로 초기화된 경우에는 덮어쓰지 않음 (다음 요청이 새로 만듦)
+                if self._char_index is stale:
+                    self._set_char_index(index, version)
+        except Exception as e:
+            logger.error("❌ 글자 인덱스 재생성 중 오류 발생: %s", e)
+        finally:
+            self._char_index_rebuilding = False
+    
+    def _set_char_index(self, index, version):
+        """새 글자 인덱스와 생성 시각, DB 버전 기록 (_char_index_lock 안에서 호출)"""
+        self._char_index = index
+        self._char_index_built_at = time.monotonic()
+        self._char_index_version = version
+    
+    def _build_char_index(self):
+        """companies 테이블 전체로 글자 역색인 생성 ((인덱스, 읽기 전 DB 버전) 반환)"""
+        # 읽기 전에 버전을 기록해 두어야 읽는 도중의 변경을 다음 확인 때 놓치지 않음
+        version = self._db_version()
+        
+        # 전체 테이블 조회는 공유 연결 잠금을 잡지 않도록 별도 연결로 실행
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute(f'SELECT {", ".join(CHAR_INDEX_COLUMNS)} FROM companies').fetchall()
+        finally:
+            conn.close()
+        
+        buckets = defaultdict(list)
+        for company in rows:
+            chars = set(company[1].lower())
+            chars.update((company[2] or '').lower())
+            for char in chars:
+                buckets[char].append(company)
+        
+        for char, companies in buckets.items():
+            companies.sort(key=lambda c: (c[1].lower() != char, len(c[1]), c[1]))
+        
+        return dict(buckets), version
+    
+    @staticmethod
+    def _rebuild_fts(cursor):
+        """companies 테이블 내용으로 FTS 인덱스 재구성"""
+        cursor.execute("INSERT INTO companies_fts(companies_fts) VALUES('rebuild')")
+    
+    def bulk_upsert(self, companies, page_size=1000):
         """
-        XML 파일을 읽어서 데이터베이스에 저장
+        회사 정보를 단일 트랜잭션으로 일괄 저장 (corp_code 기준 갱신)
         
         Args:
-            xml_path (str): CORPCODE.xml 파일 경로
+            companies (list): corp_code, corp_name, stock_code, modify_date 키를 가진 딕셔너리 리스트
+            page_size (int): executemany 한 번에 넣을 행 수
+        
+        Returns:
+            int: 저장된 행 수
         """
-        if not os.path.exists(xml_path):
-            print(f"❌ XML 파일을 찾을 수 없습니다: {xml_path}")
-            print("먼저 corp_code_downloader.py를 실행하여 회사코드 파일을 다운로드하세요.")
+        rows = [
+            (
+                company['corp_code'],
+                company['corp_name'],
+                company.get('corp_eng_name', ''),
+                company.get('stock_code', ''),
+                company.get('modify_date', '')
+            )
+            for company in companies
+        ]
+        
+        with self._bulk_load() as conn:
+            cursor = conn.cursor()
+            
+            for start in range(0, len(rows), page_size):
+                cursor.executemany('''
+                    INSERT INTO companies (corp_code, corp_name, corp_eng_name, stock_code, modify_date)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(corp_code) DO UPDATE SET
+                        corp_name = excluded.corp_name,
+                        corp_eng_name = excluded.corp_eng_name,
+                        stock_code = excluded.stock_code,
+                        modify_date = excluded.modify_date
+                ''', rows[start:start + page_size])
+            
+            self._rebuild_fts(cursor)
+            conn.commit()
+        
+        self._invalidate_search_cache()
+        return len(rows)
+    
+    def xml_to_database(self, xml_source="./data/CORPCODE.xml"):
+        """
+        XML을 읽어서 데이터베이스에 저장
+        
+        Args:
+            xml_source: CORPCODE.xml 파일 경로, XML 바이트 또는 파일 객체
+                (예: ZipFile.open으로 연 ZIP 내부 파일 - 압축 해제 파일 없이 바로 적재)
+        """
+        if isinstance(xml_source, (bytes, bytearray)):
+            xml_source = io.BytesIO(xml_source)
+        elif isinstance(xml_source, (str, os.PathLike)) and not os.path.exists(xml_source):
+            logger.error("❌ XML 파일을 찾을 수 없습니다: %s", xml_source)
+            logger.error("먼저 corp_code_downloader.py를 실행하여 회사코드 파일을 다운로드하세요.")
             return False
         
         try:
-            print("🔄 XML 파일을 읽는 중...")
-            tree = ET.parse(xml_path)
-            root = tree.getroot()
-            
-            companies = []
-            
-            # XML에서 회사 정보 추출
-            for list_elem in root.findall('list'):
-                corp_code = list_elem.find('corp_code').text if list_elem.find('corp_code') is not None else ''
-                corp_name = list_elem.find('corp_name').text if list_elem.find('corp_name') is not None else ''
-                corp_eng_name = list_elem.find('corp_eng_name').text if list_elem.find('corp_eng_name') is not None else ''
-                stock_code = list_elem.find('stock_code').text if list_elem.find('stock_code') is not None else ''
-                modify_date = list_elem.find('modify_date').text if list_elem.find('modify_date') is not None else ''
-                
-                companies.append((corp_code, corp_name, corp_eng_name, stock_code, modify_date))
+            logger.info("🔄 XML 파일을 읽는 중...")
             
-            print(f"📊 총 {len(companies):,}개 회사 정보를 추출했습니다.")
-            
-            # 데이터베이스에 저장
-            with sqlite3.connect(self.db_path) as conn:
+            # 데이터베이스에 저장 (단일 트랜잭션, 파싱 중 오류 시 전체 롤백)
+            with self._bulk_load() as conn:
                 cursor = conn.cursor()
                 
-                # 기존 데이터 삭제
+                # 기존 데이터 삭제, 인덱스는 적재 후 다시 생성
                 cursor.execute('DELETE FROM companies')
+                self._drop_indexes(cursor)
                 
-                # 새 데이터 삽입
-                cursor.executemany('''
+                # XML에서 회사 정보를 스트리밍으로 추출하여 배치 단위로 삽입
+                insert_sql = '''
                     INSERT INTO companies (corp_code, corp_name, corp_eng_name, stock_code, modify_date)
                     VALUES (?, ?, ?, ?, ?)
-                ''', companies)
+                '''
+                batch = []
+                total_count = 0
+                
+                for elem in iter_corp_elements(xml_source):
+                    batch.append((
+                        elem.findtext('corp_code', ''),
+                        elem.findtext('corp_name', ''),
+                        elem.findtext('corp_eng_name', ''),
+                        elem.findtext('stock_code', ''),
+                        elem.findtext('modify_date', '')
+                    ))
+                    
+                    if len(batch) >= XML_INSERT_BATCH_SIZE:
+                        cursor.executemany(insert_sql, batch)
+                        total_count += len(batch)
+                        batch.clear()
                 
+                if batch:
+                    cursor.executemany(insert_sql, batch)
+                    total_count += len(batch)
+                
+                logger.info("📊 총 %d개 회사 정보를 추출했습니다.", total_count)
+                
+                self._create_indexes(cursor)
+                self._rebuild_fts(cursor)
                 conn.commit()
                 
                 # 결과 확인
                 cursor.execute('SELECT COUNT(*) FROM companies')
                 count = cursor.fetchone()[0]
-                print(f"✅ 데이터베이스에 {count:,}개 회사 정보가 저장되었습니다.")
+                logger.info("✅ 데이터베이스에 %d개 회사 정보가 저장되었습니다.", count)
             
+            self._invalidate_search_cache()
             return True
             
         except Exception as e:
-            print(f"❌ 데이터베이스 변환 중 오류 발생: {str(e)}")
+            logger.error("❌ 데이터베이스 변환 중 오류 발생: %s", e)
             return False
     
+    def _search_two_chars(self, query, limit):
+        """
+        두 글자 검색 (두 글자 중 포함한 회사가 적은 쪽의 목록만 확인)
+        
+        영문 두 글자처럼 후보가 CHAR_INDEX_MAX_BUCKET보다 많으면 None을 반환해 SQL로 넘김
+        """
+        index = self._get_char_index()
+        candidates = min((index.get(char, []) for char in query), key=len)
+        if len(candidates) > CHAR_INDEX_MAX_BUCKET:
+            return None
+        matches = (
+            company for company in candidates
+            if query in company[1].lower() or query in (company[2] or '').lower()
+        )
+        return tuple(
+            dict(zip(CHAR_INDEX_COLUMNS, company))
+            for company in heapq.nsmallest(limit, matches, key=lambda c: (c[1].lower() != query, len(c[1]), c[1]))
+        )
+    
     def search_companies(self, query, limit=10):
         """
         회사명으로 회사 검색
@@ -119,35 +421,55 @@ class CorpCodeDBManager:
         Returns:
             list: 검색 결과 리스트
         """
-        with sqlite3.connect(self.db_path) as conn:
+        # 검색은 대소문자를 구분하지 않으므로 검색어를 한 번만 소문자로 정규화 (캐시 키 공유)
+        query = query.lower()
+        
+        # 자동완성에서 가장 잦은 한 글자 검색은 메모리 인덱스에서 바로 반환
+        if len(query) == 1:
+            return [dict(zip(CHAR_INDEX_COLUMNS, company)) for company in self._get_char_index().get(query, [])[:limit]]
+        
+        return list(self._search_cached(query, limit))
+    
+    def _search_companies(self, query, limit):
+        """search_companies의 실제 조회 (결과는 튜플로 반환해 캐시에 보관)"""
+        # trigram 인덱스를 쓸 수 없는 두 글자 검색은 글자 역색인으로 후보를 좁힘
+        if len(query) == 2:
+            results = self._search_two_chars(query, limit)
+            if results is not None:
+                return results
+        
+        with self._get_conn() as conn:
             cursor = conn.cursor()
             
             # 회사명에 검색어가 포함된 회사들 검색 (대소문자 구분 없음)
-            cursor.execute('''
-                SELECT corp_code, corp_name, corp_eng_name, stock_code, modify_date
-                FROM companies
-                WHERE corp_name LIKE ? OR corp_eng_name LIKE ?
-                ORDER BY 
-                    CASE WHEN corp_name = ? THEN 0 ELSE 1 END,
-                    LENGTH(corp_name),
-                    corp_name
-                LIMIT ?
-            ''', (f'%{query}%', f'%{query}%', query, limit))
-            
-            results = cursor.fetchall()
+            if len(query) >= 3:
+                # trigram 토크나이저는 3글자 이상일 때 FTS 인덱스로 부분 문자열 검색 가능
+                fts_query = '"' + query.replace('"', '""') + '"'
+                cursor.execute('''
+                    SELECT corp_code, corp_name, corp_eng_name, stock_code, modify_date
+                    FROM companies
+                    WHERE id IN (SELECT rowid FROM companies_fts WHERE companies_fts MATCH ?)
+                    ORDER BY 
+                        CASE WHEN corp_name = ? COLLATE NOCASE THEN 0 ELSE 1 END,
+                        LENGTH(corp_name),
+                        corp_name
+                    LIMIT ?
+                ''', (fts_query, query, limit))
+            else:
+                pattern = f'%{query}%'
+                cursor.execute('''
+                    SELECT corp_code, corp_name, corp_eng_name, stock_code, modify_date
+                    FROM companies
+                    WHERE corp_name LIKE ? OR corp_eng_name LIKE ?
+                    ORDER BY 
+                        CASE WHEN corp_name = ? COLLATE NOCASE THEN 0 ELSE 1 END,
+                        LENGTH(corp_name),
+                        corp_name
+                    LIMIT ?
+                ''', (pattern, pattern, query, limit))
             
             # 딕셔너리 형태로 변환
-            companies = []
-            for result in results:
-                companies.append({
-                    'corp_code': result[0],
-                    'corp_name': result[1],
-                    'corp_eng_name': result[2],
-                    'stock_code': result[3],
-                    'modify_date': result[4]
-                })
-            
-            return companies
+            return tuple(dict(row) for row in cursor.fetchall())
     
     def get_company_by_code(self, corp_code):
         """
@@ -159,7 +481,21 @@ class CorpCodeDBManager:
         Returns:
             dict: 회사 정보 또는 None
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self._search_cache_lock:
+            company = self._company_cache.get(corp_code)
+        
+        if company is None:
+            company = self._get_company_by_code(corp_code)
+            if company is None:
+                return None
+            with self._search_cache_lock:
+                self._company_cache[corp_code] = company
+        
+        return dict(company)
+    
+    def _get_company_by_code(self, corp_code):
+        """get_company_by_code의 실제 조회 (캐시 공유를 위해 호출한 쪽에는 복사본 반환)"""
+        with self._get_conn() as conn:
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -171,25 +507,20 @@ class CorpCodeDBManager:
             result = cursor.fetchone()
             
             if result:
-                return {
-                    'corp_code': result[0],
-                    'corp_name': result[1],
-                    'corp_eng_name': result[2],
-                    'stock_code': result[3],
-                    'modify_date': result[4]
-                }
+                return dict(result)
             return None
     
     def get_stats(self):
         """데이터베이스 통계 정보 반환"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._get_conn() as conn:
             cursor = conn.cursor()
             
-            cursor.execute('SELECT COUNT(*) FROM companies')
-            total_count = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM companies WHERE stock_code != ""')
-            listed_count = cursor.fetchone()[0]
+            # 전체/상장 회사 수를 한 번의 스캔으로 집계
+            cursor.execute('''
+                SELECT COUNT(*), COUNT(CASE WHEN stock_code != '' THEN 1 END)
+                FROM companies
+            ''')
+            total_count, listed_count = cursor.fetchone()
             
             return {
                 'total_companies': total_count,
@@ -200,6 +531,8 @@ class CorpCodeDBManager:
 
 def main():
     """메인 실행 함수"""
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
     print("=" * 60)
     print("🏢 회사코드 데이터베이스 설정")
     print("=" * 60)
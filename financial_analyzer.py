@@ -3,23 +3,384 @@
 Gemini API를 사용한 재무제표 분석 모듈
 """
 
+import asyncio
+import atexit
+import hashlib
+import logging
 import os
-import json
-from typing import Dict, Optional
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import orjson
 from dotenv import load_dotenv
 
 try:
     import google.generativeai as genai
+    from google.api_core.exceptions import NotFound
 except ImportError:
     genai = None
+    NotFound = None
     print("google-generativeai 패키지가 설치되지 않았습니다. pip install google-generativeai 로 설치해주세요.")
 
+# 응답의 섹션 제목 위치를 한 번의 선형 탐색으로 찾는 Aho-Corasick (없으면 정규식 분할 사용)
+try:
+    import ahocorasick
+    HAS_AHOCORASICK = True
+except ImportError:
+    HAS_AHOCORASICK = False
+
+logger = logging.getLogger(__name__)
+
 # 환경변수 로드
 load_dotenv()
 
+# 분석 프롬프트에 넣는 재무제표 항목 (섹션, 항목들)
+ANALYSIS_FIELDS = (
+    ('balance_sheet', ('total_assets', 'total_liabilities', 'total_equity')),
+    ('income_statement', ('revenue', 'operating_profit', 'net_profit')),
+)
+
+
+# 사용할 Gemini 모델 (앞에서부터 시도)
+MODEL_CANDIDATES = [
+    'gemini-1.5-flash',
+    'gemini-2.0-flash',
+    'gemini-1.5-pro',
+]
+
+# generateContent를 지원하는 모델 목록 캐시 (list_models() 결과, 프로세스 간 공유)
+GEMINI_MODELS_CACHE_PATH = './data/gemini_models.json'
+GEMINI_MODELS_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# 프롬프트에 쓰는 항목 이름
+ACCOUNT_LABELS = {
+    'total_assets': '자산총계',
+    'total_liabilities': '부채총계',
+    'total_equity': '자본총계',
+    'revenue': '매출액',
+    'operating_profit': '영업이익',
+    'net_profit': '당기순이익',
+}
+
+# 프롬프트 앞부분의 고정 지시문 (호출마다 같아서 Gemini 암시적 캐시 대상이 됨)
+# 섹션 제목은 _parse_response/_parse_trend_response가 찾는 문자열이므로 바꾸지 않음
+ANALYSIS_OUTPUT_SPEC = """아래 재무제표를 일반인도 이해할 수 있게 친근하고 쉬운 말로 분석하세요. 전년 대비 증감률(%)을 함께 계산하고, 업계 일반 수준과 비교하며, 긍정/부정 요소를 균형 있게 제시하고, 전문용어는 풀어서 설명하세요.
+형식:
+**📊 재무 건전성**
+[자산·부채·자본 구조로 본 재무 안정성]
+**💰 수익성 분석**
+[매출액·영업이익·순이익으로 본 수익창출 능력]
+**📈 성장성 분석**
+[전년 대비 변화율과 성장 여부]
+**⚠️ 주의사항**
+[투자자가 주목할 리스크나 특이사항]
+**🎯 한줄 요약**
+[재무상태를 한 문장으로]"""
+
+TREND_OUTPUT_SPEC = """아래 다년도 재무 추이를 일반인도 이해할 수 있게 분석하세요. 구체적인 증감률과 금액을 함께 제시하고, 일시적 변동과 지속적 추세를 구분하며, 업계·경제 환경을 고려해 투자자에게 의미 있는 인사이트를 주세요.
+형식:
+**📈 매출 성장 추이**
+[연도별 매출 변화와 성장 패턴]
+**💡 수익성 변화**
+[영업이익·순이익 추이로 본 수익성 변화]
+**🏗️ 자산 규모 변화**
+[자산·자본 성장으로 본 규모 확장]
+**🎯 성장률 분석**
+[연평균 성장률(CAGR)]
+**🔮 미래 전망**
+[추이를 바탕으로 한 향후 전망]
+**📋 종합 평가**
+[기간 전체 성과 종합 평가]"""
+
+# 평균 프롬프트 토큰이 PROMPT_TOKEN_BUDGETS를 넘으면 쓰는 축약 지시문 (섹션 제목은 동일)
+COMPACT_ANALYSIS_OUTPUT_SPEC = """아래 재무제표를 쉬운 말로 분석하세요(전년 대비 증감률 포함). 형식:
+**📊 재무 건전성**
+**💰 수익성 분석**
+**📈 성장성 분석**
+**⚠️ 주의사항**
+**🎯 한줄 요약**"""
+
+COMPACT_TREND_OUTPUT_SPEC = """아래 재무 추이를 쉬운 말로 분석하세요(증감률·CAGR 포함). 형식:
+**📈 매출 성장 추이**
+**💡 수익성 변화**
+**🏗️ 자산 규모 변화**
+**🎯 성장률 분석**
+**🔮 미래 전망**
+**📋 종합 평가**"""
+
+
+# 한 회사의 재무제표 데이터 블록 (CSV, _prepare_analysis_data의 평탄한 dict로 채움)
+ANALYSIS_DATA_TEMPLATE = (
+    "{company_name} {year}년 재무제표 (단위: 억원)\n"
+    "```csv\n항목,당기,전기\n"
+    + ''.join(
+        f"{ACCOUNT_LABELS[field]},{{{field}_current}},{{{field}_previous}}\n"
+        for _, fields in ANALYSIS_FIELDS
+        for field in fields
+    )
+    + "```\n"
+)
+
+# 고정 지시문이 앞, 회사별 데이터가 뒤에 오도록 조립한 프롬프트 템플릿
+ANALYSIS_PROMPT_TEMPLATE = ANALYSIS_OUTPUT_SPEC + "\n" + ANALYSIS_DATA_TEMPLATE
+COMPACT_ANALYSIS_PROMPT_TEMPLATE = COMPACT_ANALYSIS_OUTPUT_SPEC + "\n" + ANALYSIS_DATA_TEMPLATE
+
+BATCH_INSTRUCTION_TEMPLATE = (
+    "\n아래 {count}개 회사를 각각 위 형식으로 분석하세요. "
+    "각 회사 분석은 '=== 회사 번호: 회사명 ===' 줄로 시작하세요.\n"
+    "{blocks}"
+)
+BATCH_PROMPT_TEMPLATE = ANALYSIS_OUTPUT_SPEC + BATCH_INSTRUCTION_TEMPLATE
+COMPACT_BATCH_PROMPT_TEMPLATE = COMPACT_ANALYSIS_OUTPUT_SPEC + BATCH_INSTRUCTION_TEMPLATE
+
+BATCH_COMPANY_TEMPLATE = "=== 회사 {number}: {company_name} ===\n" + ANALYSIS_DATA_TEMPLATE
+
+TREND_DATA_TEMPLATE = (
+    "\n{company_name} {year_count}년간 재무 추이 (단위: 억원)\n"
+    "years=[{years}]\n"
+    "revenue=[{revenue}]\n"
+    "operating_profit=[{operating_profit}]\n"
+    "net_profit=[{net_profit}]\n"
+    "total_assets=[{total_assets}]\n"
+    "total_equity=[{total_equity}]\n"
+)
+TREND_PROMPT_TEMPLATE = TREND_OUTPUT_SPEC + TREND_DATA_TEMPLATE
+COMPACT_TREND_PROMPT_TEMPLATE = COMPACT_TREND_OUTPUT_SPEC + TREND_DATA_TEMPLATE
+
+# 프롬프트 종류별 (기본 템플릿, 축약 템플릿, 축약 지시문)
+PROMPT_TEMPLATES = {
+    'analysis': (ANALYSIS_PROMPT_TEMPLATE, COMPACT_ANALYSIS_PROMPT_TEMPLATE, COMPACT_ANALYSIS_OUTPUT_SPEC),
+    'batch': (BATCH_PROMPT_TEMPLATE, COMPACT_BATCH_PROMPT_TEMPLATE, COMPACT_ANALYSIS_OUTPUT_SPEC),
+    'trend': (TREND_PROMPT_TEMPLATE, COMPACT_TREND_PROMPT_TEMPLATE, COMPACT_TREND_OUTPUT_SPEC),
+}
+
+# 축약 지시문을 쓰면 줄어드는 글자 수 (축약 프롬프트의 토큰 수를 기본 프롬프트 기준으로 환산할 때 사용)
+COMPACT_SPEC_SAVINGS = {
+    'analysis': len(ANALYSIS_OUTPUT_SPEC) - len(COMPACT_ANALYSIS_OUTPUT_SPEC),
+    'batch': len(ANALYSIS_OUTPUT_SPEC) - len(COMPACT_ANALYSIS_OUTPUT_SPEC),
+    'trend': len(TREND_OUTPUT_SPEC) - len(COMPACT_TREND_OUTPUT_SPEC),
+}
+
+# 프롬프트 종류별 평균 프롬프트 토큰 상한 - 넘으면 축약 프롬프트로 전환
+# (기본 프롬프트 길이: 단일 회사 약 460자, 8개년 추이 약 780자, 5개 회사 일괄 약 1,300자)
+PROMPT_TOKEN_BUDGETS = {
+    'analysis': 600,
+    'batch': 1700,
+    'trend': 1000,
+}
+
+# 토큰 사용량 지수이동평균(EWMA) 가중치, 평균이 상한의 이 비율 아래로 내려가면 기본 프롬프트로 복귀
+USAGE_EWMA_ALPHA = 0.2
+COMPACT_PROMPT_RECOVERY_RATIO = 0.8
+
+
+# 응답 섹션 제목 -> 결과 키 (제목이 들어 있는 줄부터 해당 섹션)
+ANALYSIS_HEADERS = {
+    '재무 건전성': 'financial_health',
+    '수익성 분석': 'profitability',
+    '성장성 분석': 'growth',
+    '주의사항': 'warnings',
+    '한줄 요약': 'summary',
+}
+
+TREND_HEADERS = {
+    '매출 성장 추이': 'revenue_trend',
+    '수익성 변화': 'profitability_change',
+    '자산 규모 변화': 'asset_growth',
+    '성장률 분석': 'growth_rate',
+    '미래 전망': 'future_outlook',
+    '종합 평가': 'overall_evaluation',
+}
+
+
+def compile_header_pattern(headers: Dict[str, str]):
+    """섹션 제목이 들어 있는 줄 전체에 맞고 그룹 1이 제목인 정규식 (re.split으로 한 번에 분할)"""
+    alternation = '|'.join(map(re.escape, headers))
+    return re.compile(rf'^[^\n]*?({alternation})[^\n]*$', re.MULTILINE)
+
+
+def build_header_automaton(headers: Dict[str, str]):
+    """섹션 제목들로 만든 Aho-Corasick 오토마톤 (pyahocorasick이 없으면 None)"""
+    if not HAS_AHOCORASICK:
+        return None
+    automaton = ahocorasick.Automaton()
+    for header in headers:
+        automaton.add_word(header, header)
+    automaton.make_automaton()
+    return automaton
+
+
+ANALYSIS_HEADER_PATTERN = compile_header_pattern(ANALYSIS_HEADERS)
+TREND_HEADER_PATTERN = compile_header_pattern(TREND_HEADERS)
+
+ANALYSIS_HEADER_AUTOMATON = build_header_automaton(ANALYSIS_HEADERS)
+TREND_HEADER_AUTOMATON = build_header_automaton(TREND_HEADERS)
+
+
+# 일괄 분석 요청 하나에 넣는 회사 수 (회사마다 응답이 길어 출력 토큰 한도가 먼저 참)
+ANALYSIS_BATCH_SIZE = 5
+
+# 일괄 분석 응답의 회사 구분 줄 (=== 회사 1: 회사명 ===)
+BATCH_DELIMITER_PATTERN = re.compile(r'^[#*\s]*=+\s*회사\s*(\d+)\s*:.*$', re.MULTILINE)
+
+# 추이 분석에 쓰는 연도별 항목
+TREND_SERIES = ('revenue', 'operating_profit', 'net_profit', 'total_assets', 'total_equity')
+
+# 이 연도 수 이상이면 억원 변환을 NumPy로 한 번에 처리 (짧은 시계열은 배열 생성 비용이 더 큼)
+TREND_VECTORIZE_MIN_YEARS = 8
+
+
+def load_cached_models() -> Optional[List[str]]:
+    """TTL 안의 캐시된 사용 가능 모델 목록 반환 (없거나 오래됐으면 None)"""
+    try:
+        if time.time() - os.path.getmtime(GEMINI_MODELS_CACHE_PATH) >= GEMINI_MODELS_TTL_SECONDS:
+            return None
+        with open(GEMINI_MODELS_CACHE_PATH, 'rb') as f:
+            return orjson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def fetch_available_models() -> List[str]:
+    """genai.list_models()로 generateContent 지원 모델을 조회하고 디스크에 캐시"""
+    models = [
+        model.name.removeprefix('models/')
+        for model in genai.list_models()
+        if 'generateContent' in model.supported_generation_methods
+    ]
+    try:
+        os.makedirs(os.path.dirname(GEMINI_MODELS_CACHE_PATH) or '.', exist_ok=True)
+        with open(GEMINI_MODELS_CACHE_PATH, 'wb') as f:
+            f.write(orjson.dumps(models))
+    except OSError as e:
+        print(f"⚠️ 모델 목록 캐시 저장 실패: {e}")
+    return models
+
+
+def order_candidates(available: List[str]) -> List[str]:
+    """MODEL_CANDIDATES 중 사용 가능한 모델만 선호 순서대로 반환"""
+    available = set(available)
+    return [name for name in MODEL_CANDIDATES if name in available]
+
+
+def to_billion(amount) -> str:
+    """금액을 억원 단위의 프롬프트용 문자열로 변환 (CSV 구분자와 겹치지 않게 천 단위 쉼표는 넣지 않음)"""
+    if amount == 0:
+        return '0'
+    return str(round(amount / 100_000_000, 1))
+
+
+class SectionStream:
+    """
+    스트리밍으로 받은 응답 조각을 줄 단위로 나눠 섹션별로 모으는 파서
+    
+    섹션은 다음 섹션 제목이 나와야 끝나므로 feed()는 그때까지 완성된 섹션만 반환합니다.
+    early_stop이면 마지막 섹션 내용이 나온 뒤 요청하지 않은 최상위 제목 줄(**📌 ...**처럼
+    이모지/기호로 시작하는 굵은 줄)이 시작될 때 finished가 되고 그 줄부터는 버립니다
+    (나머지 생성을 기다리지 않고 중단할 수 있음). **긍정적 요소** 같은 글자로 시작하는
+    소제목은 섹션 내용으로 둡니다.
+    """
+    
+    def __init__(self, headers: Dict[str, str], header_pattern, early_stop: bool = True):
+        self.headers = headers
+        self.header_pattern = header_pattern
+        self.early_stop = early_stop
+        self.last_section = list(headers.values())[-1]
+        self.finished = False
+        self._parts = []  # 처리한 원문 줄
+        self._pending = ''  # 아직 줄바꿈이 오지 않은 나머지
+        self._section = None
+        self._lines = []
+    
+    @property
+    def text(self) -> str:
+        """지금까지 받은 응답 원문 (중단한 경우 중단 지점까지)"""
+        return ''.join(self._parts) + self._pending
+    
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        """응답 조각을 넣고 새로 완성된 (섹션 키, 내용) 목록 반환"""
+        if self.finished:
+            return []
+        
+        lines = (self._pending + chunk).split('\n')
+        self._pending = lines.pop()
+        completed = []
+        for line in lines:
+            section = self._process(line)
+            if self.finished:
+                # 중단 줄 뒤에 같은 조각으로 온 나머지도 버림 (text에 섞이지 않도록)
+                self._pending = ''
+                break
+            self._parts.append(line + '\n')
+            if section:
+                completed.append(section)
+        return completed
+    
+    def close(self) -> List[Tuple[str, str]]:
+        """남은 내용을 처리하고 마지막까지 완성된 섹션 목록 반환"""
+        completed = []
+        if self._pending and not self.finished:
+            line, self._pending = self._pending, ''
+            section = self._process(line)
+            if not self.finished:
+                self._parts.append(line)
+            if section:
+                completed.append(section)
+        
+        section = self._flush()
+        if section:
+            completed.append(section)
+        return completed
+    
+    def _process(self, line: str) -> Optional[Tuple[str, str]]:
+        """한 줄 처리 (새 섹션 제목이면 직전 섹션을 완성해서 반환)"""
+        line = line.strip()
+        if not line:
+            return None
+        
+        match = self.header_pattern.search(line)
+        if match:
+            completed = self._flush()
+            self._section = self.headers[match.group(1)]
+            return completed
+        
+        if (self.early_stop and self._section == self.last_section and self._lines
+                and self._is_top_level_header(line)):
+            self.finished = True
+        elif self._section:
+            self._lines.append(line)
+        return None
+    
+    @staticmethod
+    def _is_top_level_header(line: str) -> bool:
+        """프롬프트의 섹션 제목과 같은 모양(이모지/기호로 시작하는 굵은 줄)인지"""
+        if len(line) <= 4 or not (line.startswith('**') and line.endswith('**')):
+            return False
+        title = line[2:-2].strip()
+        return bool(title) and not title[0].isalnum()
+    
+    def _flush(self) -> Optional[Tuple[str, str]]:
+        """현재 섹션을 (섹션 키, 내용)으로 반환하고 비움"""
+        if self._section is None:
+            return None
+        completed = (self._section, ''.join(line + '\n' for line in self._lines))
+        self._section = None
+        self._lines = []
+        return completed
+
+
 class FinancialAnalyzer:
-    def __init__(self):
-        """Gemini API를 사용한 재무분석기 초기화"""
+    def __init__(self, cache_db_path: Optional[str] = "./data/corpcode.db"):
+        """
+        Gemini API를 사용한 재무분석기 초기화
+        
+        Args:
+            cache_db_path (str): 분석 응답 캐시를 저장할 SQLite 파일 경로 (None이면 캐시 사용 안 함)
+        """
         self.api_key = os.getenv('GEMINI_API_KEY')
         
         if not self.api_key or self.api_key == 'your_gemini_api_key_here':
@@ -28,44 +389,174 @@ class FinancialAnalyzer:
         if genai is None:
             raise ImportError("google-generativeai 패키지가 필요합니다.")
         
-        # Gemini API 설정
-        genai.configure(api_key=self.api_key)
+        # Gemini API 설정 (기본 gRPC 채널은 프로세스 동안 재사용되며, gevent 워커에서는
+        # app.py/gunicorn_conf.py가 init_gevent()로 gRPC를 전환해 둠.
+        # 비동기 경로가 필요 없는 배포는 GEMINI_TRANSPORT=rest로 REST 전송을 쓸 수 있음)
+        genai.configure(api_key=self.api_key, transport=os.getenv('GEMINI_TRANSPORT') or None)
+        
+        # 모델은 첫 요청 때 만들고, 모델이 없다는 404를 받으면 다음 후보로 넘어감
+        # (GenerativeModel 생성은 이름을 검증하지 않으므로 미리 만들어 볼 필요가 없음)
+        # 디스크에 캐시된 모델 목록이 있으면 그중 사용 가능한 후보부터 시도
+        cached_models = load_cached_models()
+        self._candidates = (cached_models and order_candidates(cached_models)) or MODEL_CANDIDATES
+        self._candidate_index = 0
+        self._model = None
+        self._models_refreshed = False
+        # 후보 상태는 여러 스레드가 공유하므로 모델 생성과 후보 전환은 잠금 안에서
+        self._model_lock = threading.Lock()
+        
+        # 토큰 사용량/캐시 통계 (여러 스레드가 같은 분석기를 쓰므로 잠금)
+        self._usage_lock = threading.Lock()
+        self._usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'cache_hits': 0, 'cache_misses': 0}
+        self._avg_prompt_tokens = {}  # 프롬프트 종류 -> 기본 프롬프트 기준 프롬프트 토큰 EWMA
+        self._compact_kinds = set()  # 축약 프롬프트를 쓰는 프롬프트 종류
         
-        # 사용 가능한 모델 확인 및 설정
-        model_options = [
-            'gemini-1.5-flash',
-            'models/gemini-1.5-flash',
-            'gemini-2.0-flash',
-            'models/gemini-2.0-flash',
-            'gemini-1.5-pro',
-            'models/gemini-1.5-pro'
-        ]
+        # (모델, 프롬프트)별 응답 캐시 - 같은 회사/연도의 같은 수치는 같은 프롬프트가 됨
+        # 연결은 인스턴스 수명 동안 하나만 열어 잠금으로 직렬화 (gevent 환경에서는
+        # threading.local이 greenlet별이 되어 요청마다 새 연결이 열림)
+        self.cache_db_path = cache_db_path
+        self._cache_lock = threading.Lock()
+        self._conn = None
+        if cache_db_path:
+            os.makedirs(os.path.dirname(cache_db_path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(cache_db_path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            with self._cache_conn() as conn, conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS gemini_cache (
+                        key TEXT PRIMARY KEY,
+                        response TEXT NOT NULL,
+                        created_at INTEGER NOT NULL
+                    )
+                ''')
+    
+    @property
+    def model(self):
+        """현재 후보 Gemini 모델 (첫 사용 시 생성)"""
+        model = self._model
+        if model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = genai.GenerativeModel(self._candidates[self._candidate_index])
+                model = self._model
+        return model
+    
+    @property
+    def model_name(self) -> str:
+        """현재 후보 모델 이름"""
+        return self.model.model_name
+    
+    def _next_model(self, api_error: Exception, failed_model) -> bool:
+        """
+        모델을 찾을 수 없다는 오류이면 다음 후보 모델로 바꾸고 True 반환
         
-        self.model = None
-        last_error = None
+        failed_model은 요청에 사용한 모델로, 그사이 다른 스레드가 이미 후보를 바꿨으면
+        한 번 더 넘기지 않고 바뀐 모델로 다시 시도하도록 True를 반환합니다.
+        """
+        if NotFound is None or not isinstance(api_error, NotFound):
+            return False
         
-        for model_name in model_options:
+        with self._model_lock:
+            if self._model is not failed_model:
+                return True
+            return self._advance_candidate(api_error)
+    
+    def _advance_candidate(self, api_error: Exception) -> bool:
+        """_next_model의 후보 전환 (_model_lock 안에서 호출)"""
+        failed = self._candidates[self._candidate_index]
+        print(f"⚠️ 모델 {failed} 사용 불가: {api_error}")
+        
+        # 처음 404가 났을 때 한 번만 실제 모델 목록을 조회해 후보를 다시 정함
+        if not self._models_refreshed:
+            self._models_refreshed = True
             try:
-                self.model = genai.GenerativeModel(model_name)
-                print(f"✅ Gemini 모델 초기화 성공: {model_name}")
-                break
+                candidates = [name for name in order_candidates(fetch_available_models()) if name != failed]
             except Exception as e:
-                last_error = e
-                print(f"⚠️ 모델 {model_name} 초기화 실패: {e}")
-                continue
+                print(f"⚠️ 모델 목록 조회 실패: {e}")
+            else:
+                if not candidates:
+                    print("❌ 사용할 수 있는 Gemini 모델이 없습니다.")
+                    if os.getenv('FS_APP_DEBUG_MODELS'):
+                        list_available_models()
+                    return False
+                self._candidates = candidates
+                self._candidate_index = 0
+                self._model = None
+                return True
+        
+        if self._candidate_index + 1 >= len(self._candidates):
+            print("❌ 사용할 수 있는 Gemini 모델이 없습니다.")
+            if os.getenv('FS_APP_DEBUG_MODELS'):
+                list_available_models()
+            return False
         
-        if self.model is None:
-            print(f"❌ 모든 모델 초기화 실패. 마지막 오류: {last_error}")
-            # 사용 가능한 모델 목록 출력
+        self._candidate_index += 1
+        self._model = None
+        return True
+    
+    def _start_stream(self, prompt: str):
+        """스트리밍 요청 시작 (첫 응답 조각을 받을 때 모델 오류가 드러남)"""
+        while True:
+            model = self.model
+            try:
+                return model.generate_content(prompt, stream=True)
+            except Exception as api_error:
+                if not self._next_model(api_error, model):
+                    raise
+    
+    async def _astart_stream(self, prompt: str):
+        """_start_stream의 asyncio 버전"""
+        while True:
+            model = self.model
             try:
-                models = genai.list_models()
-                print("사용 가능한 모델 목록:")
-                for model in models:
-                    if 'generateContent' in model.supported_generation_methods:
-                        print(f"  - {model.name}")
-            except:
-                pass
-            raise ValueError("Gemini 모델을 초기화할 수 없습니다.")
+                return await model.generate_content_async(prompt, stream=True)
+            except Exception as api_error:
+                if not self._next_model(api_error, model):
+                    raise
+    
+    @contextmanager
+    def _cache_conn(self):
+        """공유 캐시 DB 연결을 잠금을 잡은 상태로 반환 (닫혔으면 None)"""
+        with self._cache_lock:
+            yield self._conn
+    
+    def close(self):
+        """캐시 DB 연결을 닫음 (이후에는 캐시 없이 동작)"""
+        with self._cache_lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+    
+    def _cache_key(self, prompt: str) -> str:
+        """모델 이름과 프롬프트로 만든 캐시 키 (orjson 배열로 직렬화해 경계가 모호하지 않음)"""
+        return hashlib.sha256(orjson.dumps([self.model_name, prompt])).hexdigest()
+    
+    def _read_cache(self, key: str) -> Optional[str]:
+        """캐시된 응답 텍스트 반환 (없으면 None)"""
+        try:
+            with self._cache_conn() as conn:
+                if conn is None:
+                    return None
+                row = conn.execute(
+                    'SELECT response FROM gemini_cache WHERE key = ?', (key,)
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+    
+    def _write_cache(self, key: str, response_text: str):
+        """응답 텍스트를 캐시에 저장"""
+        try:
+            with self._cache_conn() as conn:
+                if conn is None:
+                    return
+                with conn:
+                    conn.execute('''
+                        INSERT OR REPLACE INTO gemini_cache (key, response, created_at)
+                        VALUES (?, ?, ?)
+                    ''', (key, response_text, int(time.time())))
+        except sqlite3.Error:
+            pass
     
     def analyze_financial_data(self, company_name: str, financial_summary: Dict) -> Dict:
         """
@@ -79,38 +570,26 @@ class FinancialAnalyzer:
             dict: 분석 결과
         """
         try:
-            # 재무데이터 준비
-            analysis_data = self._prepare_analysis_data(company_name, financial_summary)
-            
-            # 프롬프트 생성
-            prompt = self._create_analysis_prompt(analysis_data)
-            
-            # Gemini API 호출
-            try:
-                response = self.model.generate_content(prompt)
-                
-                # 응답 확인
-                if not hasattr(response, 'text') or not response.text:
-                    raise ValueError("Gemini에서 유효한 응답을 받지 못했습니다.")
-                
-                # 응답 파싱
-                analysis_result = self._parse_response(response.text)
-                
-            except Exception as api_error:
-                # API 호출 관련 상세 에러 정보 제공
-                error_msg = str(api_error)
-                if "404" in error_msg and "models" in error_msg:
-                    error_msg = "사용 중인 Gemini 모델이 더 이상 지원되지 않습니다. 모델 업데이트가 필요합니다."
-                elif "quota" in error_msg.lower():
-                    error_msg = "Gemini API 할당량이 초과되었습니다. 잠시 후 다시 시도해주세요."
-                elif "authentication" in error_msg.lower() or "api_key" in error_msg.lower():
-                    error_msg = "Gemini API 키가 유효하지 않습니다. API 키를 확인해주세요."
-                
-                raise Exception(f"Gemini API 호출 실패: {error_msg}")
+            prompt = self._create_analysis_prompt(self._prepare_analysis_data(company_name, financial_summary))
+            return {
+                'success': True,
+                'analysis': self._parse_response(self._generate(prompt, ANALYSIS_HEADERS, ANALYSIS_HEADER_PATTERN)),
+                'company_name': company_name
+            }
             
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'분석 중 오류 발생: {str(e)}'
+            }
+    
+    async def aanalyze_financial_data(self, company_name: str, financial_summary: Dict) -> Dict:
+        """analyze_financial_data의 asyncio 버전 (Gemini 응답을 기다리는 동안 이벤트 루프를 막지 않음)"""
+        try:
+            prompt = self._create_analysis_prompt(self._prepare_analysis_data(company_name, financial_summary))
             return {
                 'success': True,
-                'analysis': analysis_result,
+                'analysis': self._parse_response(await self._agenerate(prompt, ANALYSIS_HEADERS, ANALYSIS_HEADER_PATTERN)),
                 'company_name': company_name
             }
             
@@ -132,38 +611,26 @@ class FinancialAnalyzer:
             dict: 추이 분석 결과
         """
         try:
-            # 추이 데이터 준비
-            trend_data = self._prepare_trend_data(company_name, multi_year_data)
-            
-            # 추이 분석 프롬프트 생성
-            prompt = self._create_trend_analysis_prompt(trend_data)
-            
-            # Gemini API 호출
-            try:
-                response = self.model.generate_content(prompt)
-                
-                # 응답 확인
-                if not hasattr(response, 'text') or not response.text:
-                    raise ValueError("Gemini에서 유효한 응답을 받지 못했습니다.")
-                
-                # 응답 파싱
-                trend_analysis = self._parse_trend_response(response.text)
-                
-            except Exception as api_error:
-                # API 호출 관련 상세 에러 정보 제공
-                error_msg = str(api_error)
-                if "404" in error_msg and "models" in error_msg:
-                    error_msg = "사용 중인 Gemini 모델이 더 이상 지원되지 않습니다. 모델 업데이트가 필요합니다."
-                elif "quota" in error_msg.lower():
-                    error_msg = "Gemini API 할당량이 초과되었습니다. 잠시 후 다시 시도해주세요."
-                elif "authentication" in error_msg.lower() or "api_key" in error_msg.lower():
-                    error_msg = "Gemini API 키가 유효하지 않습니다. API 키를 확인해주세요."
-                
-                raise Exception(f"Gemini API 호출 실패: {error_msg}")
+            prompt = self._create_trend_analysis_prompt(self._prepare_trend_data(company_name, multi_year_data))
+            return {
+                'success': True,
+                'trend_analysis': self._parse_trend_response(self._generate(prompt, TREND_HEADERS, TREND_HEADER_PATTERN, prompt_kind='trend')),
+                'company_name': company_name
+            }
             
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'추이 분석 중 오류 발생: {str(e)}'
+            }
+    
+    async def aanalyze_financial_trends(self, company_name: str, multi_year_data: Dict) -> Dict:
+        """analyze_financial_trends의 asyncio 버전"""
+        try:
+            prompt = self._create_trend_analysis_prompt(self._prepare_trend_data(company_name, multi_year_data))
             return {
                 'success': True,
-                'trend_analysis': trend_analysis,
+                'trend_analysis': self._parse_trend_response(await self._agenerate(prompt, TREND_HEADERS, TREND_HEADER_PATTERN, prompt_kind='trend')),
                 'company_name': company_name
             }
             
@@ -173,186 +640,362 @@ class FinancialAnalyzer:
                 'error': f'추이 분석 중 오류 발생: {str(e)}'
             }
     
+    async def analyze_many(self, companies: List[Tuple[str, Dict]]) -> List[Dict]:
+        """
+        여러 회사의 재무제표를 동시에 분석
+        
+        Args:
+            companies (list): (회사명, 재무제표 요약 데이터) 목록
+        
+        Returns:
+            list: 회사 순서대로 analyze_financial_data와 같은 형식의 분석 결과
+        """
+        return await asyncio.gather(*[
+            self.aanalyze_financial_data(company_name, financial_summary)
+            for company_name, financial_summary in companies
+        ])
+    
+    async def astream_analysis(self, company_name: str, financial_summary: Dict):
+        """
+        재무제표 분석 결과를 섹션이 완성되는 대로 반환하는 비동기 제너레이터
+        
+        Args:
+            company_name (str): 회사명
+            financial_summary (dict): 재무제표 요약 데이터
+        
+        Yields:
+            tuple: (섹션 키, 내용) - 마지막에 ('full_text', 전체 응답)
+        """
+        prompt = self._create_analysis_prompt(self._prepare_analysis_data(company_name, financial_summary))
+        async for section in self._astream_sections(prompt, ANALYSIS_HEADERS, ANALYSIS_HEADER_PATTERN):
+            yield section
+    
+    def analyze_financial_data_batch(self, companies: List[Tuple[str, Dict]],
+                                     batch_size: int = ANALYSIS_BATCH_SIZE) -> List[Dict]:
+        """
+        여러 회사의 재무제표를 batch_size개씩 한 번의 Gemini 요청으로 분석
+        
+        Args:
+            companies (list): (회사명, 재무제표 요약 데이터) 목록
+            batch_size (int): 요청 하나에 넣을 회사 수
+        
+        Returns:
+            list: 회사 순서대로 analyze_financial_data와 같은 형식의 분석 결과
+        """
+        results = []
+        for start in range(0, len(companies), batch_size):
+            batch = companies[start:start + batch_size]
+            try:
+                prompt = self._create_batch_analysis_prompt([
+                    self._prepare_analysis_data(company_name, financial_summary)
+                    for company_name, financial_summary in batch
+                ])
+                text = self._generate(prompt, ANALYSIS_HEADERS, ANALYSIS_HEADER_PATTERN, early_stop=False, prompt_kind='batch')
+                results.extend(self._split_batch_response(batch, text))
+            except Exception as e:
+                results.extend({'success': False, 'error': f'분석 중 오류 발생: {str(e)}'} for _ in batch)
+        return results
+    
+    async def aanalyze_financial_data_batch(self, companies: List[Tuple[str, Dict]],
+                                            batch_size: int = ANALYSIS_BATCH_SIZE) -> List[Dict]:
+        """analyze_financial_data_batch의 asyncio 버전 (묶음 요청들을 동시에 실행)"""
+        async def analyze_batch(batch):
+            try:
+                prompt = self._create_batch_analysis_prompt([
+                    self._prepare_analysis_data(company_name, financial_summary)
+                    for company_name, financial_summary in batch
+                ])
+                text = await self._agenerate(prompt, ANALYSIS_HEADERS, ANALYSIS_HEADER_PATTERN, early_stop=False, prompt_kind='batch')
+                return self._split_batch_response(batch, text)
+            except Exception as e:
+                return [{'success': False, 'error': f'분석 중 오류 발생: {str(e)}'} for _ in batch]
+        
+        batch_results = await asyncio.gather(*[
+            analyze_batch(companies[start:start + batch_size])
+            for start in range(0, len(companies), batch_size)
+        ])
+        return [result for results in batch_results for result in results]
+    
+    def _split_batch_response(self, batch: List[Tuple[str, Dict]], response_text: str) -> List[Dict]:
+        """일괄 분석 응답을 회사 번호 구분 줄로 나눠 회사별 분석 결과로 변환"""
+        parts = BATCH_DELIMITER_PATTERN.split(response_text)
+        bodies = {int(parts[i]): parts[i + 1].strip() for i in range(1, len(parts) - 1, 2)}
+        
+        results = []
+        for number, (company_name, _) in enumerate(batch, 1):
+            body = bodies.get(number)
+            if body:
+                results.append({
+                    'success': True,
+                    'analysis': self._parse_response(body),
+                    'company_name': company_name
+                })
+            else:
+                results.append({
+                    'success': False,
+                    'error': f'분석 중 오류 발생: 일괄 분석 응답에 {company_name} 분석이 없습니다.'
+                })
+        return results
+    
+    def _generate(self, prompt: str, headers: Dict[str, str], header_pattern,
+                  early_stop: bool = True, prompt_kind: str = 'analysis') -> str:
+        """Gemini 응답 텍스트 반환 (스트리밍으로 받고, early_stop이면 요청한 섹션이 끝날 때 중단)"""
+        return dict(self._stream_sections(prompt, headers, header_pattern, early_stop, prompt_kind))['full_text']
+    
+    async def _agenerate(self, prompt: str, headers: Dict[str, str], header_pattern,
+                         early_stop: bool = True, prompt_kind: str = 'analysis') -> str:
+        """_generate의 asyncio 버전"""
+        sections = [section async for section in self._astream_sections(prompt, headers, header_pattern, early_stop, prompt_kind)]
+        return dict(sections)['full_text']
+    
+    def _stream_sections(self, prompt: str, headers: Dict[str, str], header_pattern,
+                         early_stop: bool = True, prompt_kind: str = 'analysis'):
+        """
+        Gemini API를 스트리밍으로 호출해 완성된 섹션을 (섹션 키, 내용)으로 차례로 반환
+        
+        마지막에 ('full_text', 전체 응답)을 반환합니다. 같은 프롬프트는 캐시된 응답을 사용합니다.
+        prompt_kind는 토큰 사용량을 집계할 프롬프트 종류 (PROMPT_TEMPLATES의 키)입니다.
+        """
+        key = self._cache_key(prompt)
+        stream = SectionStream(headers, header_pattern, early_stop)
+        
+        cached = self._read_cache(key)
+        self._count_cache(cached is not None)
+        if cached is not None:
+            yield from stream.feed(cached)
+            yield from stream.close()
+            yield 'full_text', cached
+            return
+        
+        usage = None
+        try:
+            for chunk in self._start_stream(prompt):
+                usage = getattr(chunk, 'usage_metadata', None) or usage
+                yield from stream.feed(self._chunk_text(chunk))
+                if stream.finished:
+                    break
+        except Exception as api_error:
+            raise Exception(f"Gemini API 호출 실패: {self._describe_api_error(api_error)}")
+        
+        self._record_usage(prompt_kind, prompt, usage)
+        yield from stream.close()
+        yield 'full_text', self._finish_stream(prompt, stream)
+    
+    async def _astream_sections(self, prompt: str, headers: Dict[str, str], header_pattern,
+                                early_stop: bool = True, prompt_kind: str = 'analysis'):
+        """_stream_sections의 asyncio 버전 (캐시 DB 조회/저장은 스레드에서 실행해 이벤트 루프를 막지 않음)"""
+        key = self._cache_key(prompt)
+        stream = SectionStream(headers, header_pattern, early_stop)
+        
+        cached = await asyncio.to_thread(self._read_cache, key)
+        self._count_cache(cached is not None)
+        if cached is not None:
+            for section in stream.feed(cached) + stream.close():
+                yield section
+            yield 'full_text', cached
+            return
+        
+        usage = None
+        try:
+            response = await self._astart_stream(prompt)
+            async for chunk in response:
+                usage = getattr(chunk, 'usage_metadata', None) or usage
+                for section in stream.feed(self._chunk_text(chunk)):
+                    yield section
+                if stream.finished:
+                    break
+        except Exception as api_error:
+            raise Exception(f"Gemini API 호출 실패: {self._describe_api_error(api_error)}")
+        
+        self._record_usage(prompt_kind, prompt, usage)
+        for section in stream.close():
+            yield section
+        yield 'full_text', await asyncio.to_thread(self._finish_stream, prompt, stream)
+    
+    def _count_cache(self, hit: bool):
+        """응답 캐시 적중/미스 횟수 기록"""
+        with self._usage_lock:
+            self._usage['cache_hits' if hit else 'cache_misses'] += 1
+    
+    def _prompt_template(self, prompt_kind: str) -> str:
+        """프롬프트 종류의 현재 템플릿 (평균 토큰이 상한을 넘은 종류는 축약 템플릿)"""
+        template, compact_template, _ = PROMPT_TEMPLATES[prompt_kind]
+        return compact_template if prompt_kind in self._compact_kinds else template
+    
+    def _record_usage(self, prompt_kind: str, prompt: str, usage):
+        """
+        응답의 usage_metadata로 토큰 사용량을 기록
+        
+        프롬프트 종류별로 기본 프롬프트 기준 프롬프트 토큰의 지수이동평균을 유지하고,
+        PROMPT_TOKEN_BUDGETS를 넘으면 그 종류만 축약 프롬프트로 바꿉니다.
+        평균이 상한의 COMPACT_PROMPT_RECOVERY_RATIO 아래로 내려가면 기본 프롬프트로 돌아갑니다.
+        """
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+        completion_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+        
+        # 축약 프롬프트였으면 줄인 지시문만큼 토큰을 더해 기본 프롬프트 기준으로 환산
+        # (축약 중에도 전환 기준이 같아야 두 프롬프트 사이를 오가지 않음)
+        full_tokens = prompt_tokens
+        if prompt.startswith(PROMPT_TEMPLATES[prompt_kind][2]):
+            full_tokens += round(COMPACT_SPEC_SAVINGS[prompt_kind] * prompt_tokens / len(prompt))
+        
+        budget = PROMPT_TOKEN_BUDGETS[prompt_kind]
+        with self._usage_lock:
+            self._usage['prompt_tokens'] += prompt_tokens
+            self._usage['completion_tokens'] += completion_tokens
+            average = self._avg_prompt_tokens.get(prompt_kind)
+            if average is None:
+                average = float(full_tokens)
+            else:
+                average += USAGE_EWMA_ALPHA * (full_tokens - average)
+            self._avg_prompt_tokens[prompt_kind] = average
+            
+            switch = None
+            if prompt_kind not in self._compact_kinds and average > budget:
+                self._compact_kinds.add(prompt_kind)
+                switch = '축약'
+            elif prompt_kind in self._compact_kinds and average < budget * COMPACT_PROMPT_RECOVERY_RATIO:
+                self._compact_kinds.discard(prompt_kind)
+                switch = '기본'
+        
+        # 요청마다 남는 기록이므로 print 대신 debug 로그 (필요할 때만 로그 레벨로 켬)
+        logger.debug("📊 Gemini 토큰 사용: model=%s kind=%s prompt=%d completion=%d",
+                     self.model_name, prompt_kind, prompt_tokens, completion_tokens)
+        if switch:
+            logger.debug("⚠️ %s 평균 프롬프트 토큰 %.0f개 (상한 %d) - %s 프롬프트로 전환합니다.",
+                         prompt_kind, average, budget, switch)
+    
+    def get_usage_stats(self) -> Dict:
+        """
+        누적 토큰 사용량과 응답 캐시 통계 반환
+        
+        Returns:
+            dict: prompt_tokens, completion_tokens, cache_hits, cache_misses,
+                  avg_prompt_tokens (프롬프트 종류별 지수이동평균), compact_prompts (축약 프롬프트를 쓰는 종류)
+        """
+        with self._usage_lock:
+            return {
+                **self._usage,
+                'avg_prompt_tokens': dict(self._avg_prompt_tokens),
+                'compact_prompts': sorted(self._compact_kinds)
+            }
+    
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        """스트리밍 응답 조각의 텍스트 (텍스트가 없는 조각은 빈 문자열)"""
+        try:
+            return chunk.text or ''
+        except ValueError:
+            return ''
+    
+    def _finish_stream(self, prompt: str, stream: SectionStream) -> str:
+        """
+        스트리밍으로 받은 전체 응답을 확인하고 캐시에 저장 (실제로 응답한 모델 기준)
+        
+        중간에 중단한 응답은 잘못 중단했을 수도 있으므로 캐시하지 않습니다.
+        """
+        text = stream.text
+        if not text.strip():
+            raise Exception("Gemini API 호출 실패: Gemini에서 유효한 응답을 받지 못했습니다.")
+        if not stream.finished:
+            self._write_cache(self._cache_key(prompt), text)
+        return text
+    
+    @staticmethod
+    def _describe_api_error(api_error: Exception) -> str:
+        """API 호출 관련 상세 에러 정보 제공"""
+        error_msg = str(api_error)
+        if "404" in error_msg and "models" in error_msg:
+            error_msg = "사용 중인 Gemini 모델이 더 이상 지원되지 않습니다. 모델 업데이트가 필요합니다."
+        elif "quota" in error_msg.lower():
+            error_msg = "Gemini API 할당량이 초과되었습니다. 잠시 후 다시 시도해주세요."
+        elif "authentication" in error_msg.lower() or "api_key" in error_msg.lower():
+            error_msg = "Gemini API 키가 유효하지 않습니다. API 키를 확인해주세요."
+        return error_msg
+    
     def _prepare_analysis_data(self, company_name: str, summary: Dict) -> Dict:
-        """분석용 데이터 준비"""
+        """분석용 데이터 준비 (금액은 억원 단위, 프롬프트 템플릿에 바로 넣는 평탄한 dict)"""
         basic_info = summary.get('basic_info', {})
-        balance_sheet = summary.get('balance_sheet', {})
-        income_statement = summary.get('income_statement', {})
-        
-        # 금액을 억원 단위로 변환
-        def to_billion(amount):
-            if amount == 0:
-                return 0
-            return round(amount / 100_000_000, 1)
         
-        return {
+        data = {
             'company_name': company_name,
-            'year': basic_info.get('bsns_year', ''),
-            'currency': basic_info.get('currency', 'KRW'),
-            'fs_type': basic_info.get('fs_nm', ''),
-            'balance_sheet': {
-                'total_assets': {
-                    'current': to_billion(balance_sheet.get('total_assets', {}).get('current', 0)),
-                    'previous': to_billion(balance_sheet.get('total_assets', {}).get('previous', 0))
-                },
-                'total_liabilities': {
-                    'current': to_billion(balance_sheet.get('total_liabilities', {}).get('current', 0)),
-                    'previous': to_billion(balance_sheet.get('total_liabilities', {}).get('previous', 0))
-                },
-                'total_equity': {
-                    'current': to_billion(balance_sheet.get('total_equity', {}).get('current', 0)),
-                    'previous': to_billion(balance_sheet.get('total_equity', {}).get('previous', 0))
-                }
-            },
-            'income_statement': {
-                'revenue': {
-                    'current': to_billion(income_statement.get('revenue', {}).get('current', 0)),
-                    'previous': to_billion(income_statement.get('revenue', {}).get('previous', 0))
-                },
-                'operating_profit': {
-                    'current': to_billion(income_statement.get('operating_profit', {}).get('current', 0)),
-                    'previous': to_billion(income_statement.get('operating_profit', {}).get('previous', 0))
-                },
-                'net_profit': {
-                    'current': to_billion(income_statement.get('net_profit', {}).get('current', 0)),
-                    'previous': to_billion(income_statement.get('net_profit', {}).get('previous', 0))
-                }
-            }
+            'year': basic_info.get('bsns_year', '')
         }
+        for section, fields in ANALYSIS_FIELDS:
+            items = summary.get(section, {})
+            for field in fields:
+                item = items.get(field) or {}
+                data[f'{field}_current'] = to_billion(item.get('current', 0))
+                data[f'{field}_previous'] = to_billion(item.get('previous', 0))
+        return data
     
     def _create_analysis_prompt(self, data: Dict) -> str:
-        """재무분석용 프롬프트 생성"""
-        return f"""
-다음은 {data['company_name']}의 {data['year']}년 재무제표 데이터입니다. 
-일반인도 쉽게 이해할 수 있도록 친근하고 명확한 언어로 분석해주세요.
-
-## 재무상태표 (단위: 억원)
-- 자산총계: 당기 {data['balance_sheet']['total_assets']['current']}억, 전기 {data['balance_sheet']['total_assets']['previous']}억
-- 부채총계: 당기 {data['balance_sheet']['total_liabilities']['current']}억, 전기 {data['balance_sheet']['total_liabilities']['previous']}억  
-- 자본총계: 당기 {data['balance_sheet']['total_equity']['current']}억, 전기 {data['balance_sheet']['total_equity']['previous']}억
-
-## 손익계산서 (단위: 억원)
-- 매출액: 당기 {data['income_statement']['revenue']['current']}억, 전기 {data['income_statement']['revenue']['previous']}억
-- 영업이익: 당기 {data['income_statement']['operating_profit']['current']}억, 전기 {data['income_statement']['operating_profit']['previous']}억
-- 당기순이익: 당기 {data['income_statement']['net_profit']['current']}억, 전기 {data['income_statement']['net_profit']['previous']}억
-
-다음 형식으로 분석해주세요:
-
-**📊 재무 건전성**
-[자산, 부채, 자본의 구조를 보고 회사의 재무 안정성을 평가해주세요]
-
-**💰 수익성 분석**  
-[매출액, 영업이익, 순이익을 통해 회사의 수익창출 능력을 분석해주세요]
-
-**📈 성장성 분석**
-[전년 대비 변화율을 계산하고 성장 여부를 평가해주세요]
-
-**⚠️ 주의사항**
-[투자자가 주목해야 할 리스크나 특이사항이 있다면 알려주세요]
-
-**🎯 한줄 요약**
-[이 회사의 재무상태를 한 문장으로 요약해주세요]
-
-분석할 때 다음사항을 고려해주세요:
-- 백분율 변화율도 함께 계산해서 알려주세요
-- 업계 일반적인 수준과 비교해서 설명해주세요  
-- 투자 관점에서 긍정적/부정적 요소를 균형있게 제시해주세요
-- 전문용어는 쉬운 말로 풀어서 설명해주세요
-"""
+        """재무분석용 프롬프트 생성 (고정된 지시문 뒤에 CSV 형식 데이터)"""
+        return self._prompt_template('analysis').format_map(data)
+    
+    def _create_batch_analysis_prompt(self, batch_data: List[Dict]) -> str:
+        """여러 회사를 한 번에 분석하는 프롬프트 생성 (회사마다 번호 붙은 구분 줄)"""
+        blocks = '\n'.join(
+            BATCH_COMPANY_TEMPLATE.format_map(dict(data, number=number))
+            for number, data in enumerate(batch_data, 1)
+        )
+        return self._prompt_template('batch').format_map({'count': len(batch_data), 'blocks': blocks})
     
     def _prepare_trend_data(self, company_name: str, data: Dict) -> Dict:
         """추이 분석용 데이터 준비"""
-        def to_billion_list(amounts):
-            return [round(amount / 100_000_000, 1) if amount > 0 else 0 for amount in amounts]
+        if len(data['years']) >= TREND_VECTORIZE_MIN_YEARS:
+            arr = np.asarray([data[key] for key in TREND_SERIES], dtype=np.float64)
+            series = np.where(arr > 0, np.round(arr / 100_000_000, 1), 0.0).tolist()
+        else:
+            series = [
+                [round(amount / 100_000_000, 1) if amount > 0 else 0.0 for amount in data[key]]
+                for key in TREND_SERIES
+            ]
         
         return {
             'company_name': company_name,
             'years': data['years'],
-            'revenue': to_billion_list(data['revenue']),
-            'operating_profit': to_billion_list(data['operating_profit']),
-            'net_profit': to_billion_list(data['net_profit']),
-            'total_assets': to_billion_list(data['total_assets']),
-            'total_equity': to_billion_list(data['total_equity'])
+            **dict(zip(TREND_SERIES, series))
         }
     
     def _create_trend_analysis_prompt(self, data: Dict) -> str:
-        """추이 분석용 프롬프트 생성"""
-        years_str = ', '.join(map(str, data['years']))
-        revenue_str = ', '.join(map(str, data['revenue']))
-        op_profit_str = ', '.join(map(str, data['operating_profit']))
-        net_profit_str = ', '.join(map(str, data['net_profit']))
-        assets_str = ', '.join(map(str, data['total_assets']))
-        equity_str = ', '.join(map(str, data['total_equity']))
-        
-        return f"""
-다음은 {data['company_name']}의 {len(data['years'])}년간 재무 추이 데이터입니다.
-일반인도 쉽게 이해할 수 있도록 분석해주세요.
-
-## 다년도 재무 추이 (단위: 억원)
-연도: {years_str}
-매출액: {revenue_str}
-영업이익: {op_profit_str}  
-당기순이익: {net_profit_str}
-자산총계: {assets_str}
-자본총계: {equity_str}
-
-다음 형식으로 분석해주세요:
-
-**📈 매출 성장 추이**
-[매출액의 연도별 변화를 분석하고 성장 패턴을 설명해주세요]
-
-**💡 수익성 변화**
-[영업이익과 순이익의 추이를 통해 수익성 변화를 분석해주세요]
-
-**🏗️ 자산 규모 변화**  
-[자산과 자본의 성장을 통해 회사 규모 확장을 평가해주세요]
-
-**🎯 성장률 분석**
-[연평균 성장률(CAGR)을 계산해서 알려주세요]
-
-**🔮 미래 전망**
-[지금까지의 추이를 바탕으로 향후 전망을 제시해주세요]
-
-**📋 종합 평가**  
-[이 회사의 {len(data['years'])}년간 성과를 종합적으로 평가해주세요]
-
-분석 시 고려사항:
-- 구체적인 증감률과 절대 금액을 함께 제시해주세요
-- 일시적 변동과 지속적 트렌드를 구분해주세요
-- 업계 상황이나 경제 환경 변화도 고려해주세요
-- 투자자 관점에서 의미있는 인사이트를 제공해주세요
-"""
+        """추이 분석용 프롬프트 생성 (고정된 지시문 뒤에 항목별 한 줄 배열)"""
+        values = {key: ', '.join(map(str, data[key])) for key in ('years',) + TREND_SERIES}
+        return self._prompt_template('trend').format_map(dict(
+            values, company_name=data['company_name'], year_count=len(data['years'])
+        ))
     
     def _parse_response(self, response_text: str) -> Dict:
         """Gemini 응답을 파싱하여 구조화"""
-        sections = {
-            'financial_health': '',
-            'profitability': '',
-            'growth': '',
-            'warnings': '',
-            'summary': ''
-        }
+        return self._split_sections(response_text, ANALYSIS_HEADERS, ANALYSIS_HEADER_PATTERN, ANALYSIS_HEADER_AUTOMATON)
+    
+    def _parse_trend_response(self, response_text: str) -> Dict:
+        """추이 분석 응답 파싱"""
+        return self._split_sections(response_text, TREND_HEADERS, TREND_HEADER_PATTERN, TREND_HEADER_AUTOMATON)
+    
+    @staticmethod
+    def _split_sections(response_text: str, headers: Dict[str, str], header_pattern,
+                        header_automaton=None) -> Dict:
+        """섹션 제목이 있는 줄을 기준으로 응답을 섹션별 텍스트로 나눔 (오토마톤 또는 정규식 한 번으로 분할)"""
+        buffers = {section: [] for section in headers.values()}
         
         try:
-            # 섹션별로 내용 추출
-            lines = response_text.split('\n')
-            current_section = None
-            
-            for line in lines:
-                line = line.strip()
-                if '재무 건전성' in line:
-                    current_section = 'financial_health'
-                elif '수익성 분석' in line:
-                    current_section = 'profitability'
-                elif '성장성 분석' in line:
-                    current_section = 'growth'
-                elif '주의사항' in line:
-                    current_section = 'warnings'
-                elif '한줄 요약' in line:
-                    current_section = 'summary'
-                elif current_section and line:
-                    sections[current_section] += line + '\n'
+            # [첫 제목 앞부분, 제목, 내용, 제목, 내용, ...]
+            if header_automaton is not None:
+                parts = FinancialAnalyzer._split_header_lines(response_text, header_automaton)
+            else:
+                parts = header_pattern.split(response_text)
+            for i in range(1, len(parts), 2):
+                buffers[headers[parts[i]]].extend(
+                    line for line in map(str.strip, parts[i + 1].split('\n')) if line
+                )
             
+            sections = {
+                section: ''.join(line + '\n' for line in lines)
+                for section, lines in buffers.items()
+            }
             # 전체 텍스트도 저장
             sections['full_text'] = response_text
             
@@ -365,47 +1008,53 @@ class FinancialAnalyzer:
         
         return sections
     
-    def _parse_trend_response(self, response_text: str) -> Dict:
-        """추이 분석 응답 파싱"""
-        sections = {
-            'revenue_trend': '',
-            'profitability_change': '',
-            'asset_growth': '',
-            'growth_rate': '',
-            'future_outlook': '',
-            'overall_evaluation': ''
-        }
+    @staticmethod
+    def _split_header_lines(response_text: str, header_automaton) -> List[str]:
+        """
+        오토마톤으로 찾은 제목 줄 기준으로 응답을 나눔 (compile_header_pattern 정규식의 re.split과 같은 결과)
         
-        try:
-            lines = response_text.split('\n')
-            current_section = None
-            
-            for line in lines:
-                line = line.strip()
-                if '매출 성장 추이' in line:
-                    current_section = 'revenue_trend'
-                elif '수익성 변화' in line:
-                    current_section = 'profitability_change'
-                elif '자산 규모 변화' in line:
-                    current_section = 'asset_growth'
-                elif '성장률 분석' in line:
-                    current_section = 'growth_rate'
-                elif '미래 전망' in line:
-                    current_section = 'future_outlook'
-                elif '종합 평가' in line:
-                    current_section = 'overall_evaluation'
-                elif current_section and line:
-                    sections[current_section] += line + '\n'
-            
-            sections['full_text'] = response_text
-            
-        except Exception as e:
-            sections = {
-                'full_text': response_text,
-                'parsing_error': str(e)
-            }
+        한 줄에 제목이 여러 개면 가장 앞에 있는 제목을 씁니다.
+        """
+        line_headers = {}  # 줄 시작 위치 -> (제목 시작 위치, 제목)
+        for end, header in header_automaton.iter(response_text):
+            start = end - len(header) + 1
+            line_start = response_text.rfind('\n', 0, start) + 1
+            found = line_headers.get(line_start)
+            if found is None or start < found[0]:
+                line_headers[line_start] = (start, header)
         
-        return sections
+        parts = []
+        body_start = 0
+        for line_start in sorted(line_headers):
+            line_end = response_text.find('\n', line_start)
+            if line_end == -1:
+                line_end = len(response_text)
+            parts.append(response_text[body_start:line_start])
+            parts.append(line_headers[line_start][1])
+            body_start = line_end
+        parts.append(response_text[body_start:])
+        return parts
+
+
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+
+def get_analyzer() -> FinancialAnalyzer:
+    """
+    프로세스 전체에서 공유하는 FinancialAnalyzer 반환
+    
+    요청마다 새로 만들면 genai.configure와 Gemini 연결 설정을 반복하므로 한 번만 생성합니다.
+    생성에 실패하면 (API 키 없음 등) 예외를 그대로 전달하고 다음 호출에서 다시 시도합니다.
+    """
+    global _analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                analyzer = FinancialAnalyzer()
+                atexit.register(analyzer.close)
+                _analyzer = analyzer
+    return _analyzer
 
 
 # 사용 가능한 모델 확인 함수
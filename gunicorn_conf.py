@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+gunicorn 배포 설정 (gevent 워커)
+
+사용법: gunicorn -c gunicorn_conf.py app:app
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+
+# DART/Gemini 호출은 네트워크 대기 위주이므로 gevent 워커로 동시 처리
+worker_class = 'gevent'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_connections = 1000
+
+# Gemini 분석은 수 초가 걸릴 수 있음
+timeout = 120
+
+
+def post_worker_init(worker):
+    """gevent 패치가 끝난 워커에서 gRPC(Gemini 클라이언트)를 gevent 호환 모드로 전환"""
+    try:
+        import grpc.experimental.gevent as grpc_gevent
+        grpc_gevent.init_gevent()
+    except ImportError:
+        pass
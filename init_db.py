@@ -3,18 +3,64 @@
 배포 환경에서 데이터베이스 초기화 스크립트
 """
 
+import hashlib
+import json
+import logging
 import os
-import urllib.request
+import time
 import zipfile
 from db_setup import CorpCodeDBManager
 
+CORPCODE_ZIP_PATH = './data/CORPCODE.zip'
+CORPCODE_META_PATH = './data/corpcode.meta.json'
+
+# 받아둔 ZIP이 이 시간(초)보다 새로우면 DART에 요청하지 않음
+CORPCODE_TTL_SECONDS = 24 * 60 * 60
+
+# DART 요청 타임아웃 (연결, 응답 읽기) 초
+REQUEST_TIMEOUT = (3.05, 30)
+
+# 스트리밍 다운로드 시 한 번에 기록할 청크 크기 (bytes)
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+
+_http_session = None
+
+def get_http_session():
+    """keep-alive 연결을 재사용하는 공유 HTTP 세션 반환"""
+    global _http_session
+    if _http_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        _http_session = requests.Session()
+        _http_session.headers.update({'User-Agent': 'fs-app/1.0'})
+        _http_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+    return _http_session
+
+def find_xml_member(zip_ref):
+    """회사코드 ZIP에서 XML 파일 이름 반환"""
+    for name in zip_ref.namelist():
+        if name.lower().endswith('.xml'):
+            return name
+    raise zipfile.BadZipFile("ZIP 파일에서 XML 파일을 찾을 수 없습니다.")
+
+def load_corpcode_meta():
+    """이전 다운로드의 ETag/Last-Modified/SHA-256 메타데이터 로드"""
+    try:
+        with open(CORPCODE_META_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_corpcode_meta(meta):
+    """다운로드 메타데이터 저장"""
+    with open(CORPCODE_META_PATH, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
 def download_corpcode_data():
     """
     배포 환경에서 Open DART 회사코드 데이터 다운로드
     """
     try:
-        import requests
-        
         # 환경변수 로딩 (배포 환경 고려)
         try:
             from dotenv import load_dotenv
@@ -34,40 +80,87 @@ def download_corpcode_data():
         # 데이터 디렉터리 생성
         os.makedirs('./data', exist_ok=True)
         
-        # API 호출
-        url = "https://opendart.fss.or.kr/api/corpCode.xml"
-        params = {'crtfc_key': api_key}
+        zip_path = CORPCODE_ZIP_PATH
+        part_path = zip_path + '.part'
+        has_zip = os.path.exists(zip_path)
         
-        response = requests.get(url, params=params, timeout=30)
+        # 최근에 받은 ZIP이 있으면 요청 생략
+        if has_zip and time.time() - os.path.getmtime(zip_path) < CORPCODE_TTL_SECONDS:
+            print("✅ 최근에 받은 회사코드 데이터 사용 (다운로드 생략)")
+            return True
         
-        print(f"🔍 API 응답 상태: {response.status_code}")
+        # API 호출 (이전 응답의 ETag/Last-Modified로 조건부 요청)
+        url = "https://opendart.fss.or.kr/api/corpCode.xml"
+        params = {'crtfc_key': api_key}
+        meta = load_corpcode_meta() if has_zip else {}
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
         
-        if response.status_code == 200:
-            # 응답 내용 확인
-            if len(response.content) < 1000:
-                print(f"⚠️ 응답 내용이 너무 짧습니다: {response.content[:200]}...")
-                return False
-            
-            # ZIP 파일 저장
-            zip_path = './data/CORPCODE.zip'
-            with open(zip_path, 'wb') as f:
-                f.write(response.content)
-            
-            print(f"📁 ZIP 파일 크기: {len(response.content):,} bytes")
+        # 응답 전체를 메모리에 올리지 않고 청크 단위로 임시 파일에 기록
+        with get_http_session().get(url, params=params, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            print(f"🔍 API 응답 상태: {response.status_code}")
             
-            # ZIP 파일 압축 해제
-            try:
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    zip_ref.extractall('./data')
-                print("✅ 회사코드 데이터 다운로드 완료")
+            if response.status_code == 304:
+                os.utime(zip_path)
+                print("✅ 회사코드 데이터 변경 없음 (304 Not Modified)")
                 return True
-            except zipfile.BadZipFile:
-                print(f"❌ ZIP 파일이 손상되었습니다. 내용: {response.content[:200]}...")
+            
+            if response.status_code != 200:
+                print(f"❌ 다운로드 실패: HTTP {response.status_code}")
+                print(f"📄 응답 내용: {response.text[:500]}...")
                 return False
-        else:
-            print(f"❌ 다운로드 실패: HTTP {response.status_code}")
-            print(f"📄 응답 내용: {response.text[:500]}...")
+            
+            size = 0
+            digest = hashlib.sha256()
+            with open(part_path, 'wb') as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            
+            new_meta = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'sha256': digest.hexdigest(),
+            }
+        
+        # 응답 내용 확인 (오류 응답은 짧은 XML/JSON으로 옴)
+        if size < 1000:
+            with open(part_path, 'rb') as f:
+                head = f.read(200)
+            os.remove(part_path)
+            print(f"⚠️ 응답 내용이 너무 짧습니다: {head}...")
             return False
+        
+        print(f"📁 ZIP 파일 크기: {size:,} bytes")
+        
+        # 200이지만 내용이 이전과 같으면 기존 ZIP 유지
+        if has_zip and new_meta['sha256'] == meta.get('sha256'):
+            os.remove(part_path)
+            os.utime(zip_path)
+            save_corpcode_meta(new_meta)
+            print("✅ 회사코드 데이터 변경 없음 (동일한 내용)")
+            return True
+        
+        # ZIP 파일 확인 (XML은 압축을 풀지 않고 적재 시 ZIP에서 바로 읽음)
+        try:
+            with zipfile.ZipFile(part_path, 'r') as zip_ref:
+                find_xml_member(zip_ref)
+        except zipfile.BadZipFile:
+            with open(part_path, 'rb') as f:
+                head = f.read(200)
+            os.remove(part_path)
+            print(f"❌ ZIP 파일이 손상되었습니다. 내용: {head}...")
+            return False
+        
+        # 검증이 끝난 파일만 기존 ZIP과 교체
+        os.replace(part_path, zip_path)
+        save_corpcode_meta(new_meta)
+        print("✅ 회사코드 데이터 다운로드 완료")
+        return True
     
     except Exception as e:
         print(f"❌ 다운로드 오류: {str(e)}")
@@ -86,8 +179,16 @@ def init_database():
         # 데이터베이스 설정
         db_manager = CorpCodeDBManager()
         
-        # XML을 데이터베이스로 변환
-        if db_manager.xml_to_database('./data/CORPCODE.xml'):
+        # ZIP 안의 XML을 임시 파일 없이 데이터베이스로 변환
+        # xml_to_database는 iterparse로 <list> 단위로 읽고 바로 비우므로 메모리 사용이 일정함
+        # (ElementTree.parse처럼 수십 MB 문서 전체를 트리로 만드는 방식으로 바꾸면 안 됨)
+        with zipfile.ZipFile(CORPCODE_ZIP_PATH) as zip_ref:
+            xml_member = zip_ref.getinfo(find_xml_member(zip_ref))
+            print(f"📁 XML {xml_member.file_size / 1e6:.1f}MB (압축 {xml_member.compress_size / 1e6:.1f}MB)")
+            with zip_ref.open(xml_member) as xml_stream:
+                converted = db_manager.xml_to_database(xml_stream)
+        
+        if converted:
             stats = db_manager.get_stats()
             print(f"✅ 데이터베이스 초기화 완료: {stats['total_companies']:,}개 회사")
             return True
@@ -100,6 +201,8 @@ def init_database():
         return False
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
     print("=" * 50)
     print("🚀 배포용 데이터베이스 초기화")
     print("=" * 50)
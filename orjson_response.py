@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+orjson 기반 JSON 응답 헬퍼
+"""
+
+import hashlib
+
+import orjson
+from flask import Response, request
+
+
+def orjson_response(obj, status=200, max_age=None):
+    """
+    orjson으로 직렬화한 JSON 응답 생성
+
+    정상 응답에는 본문 해시로 만든 ETag를 붙이고, 요청의 If-None-Match와
+    일치하면 본문 없이 304 Not Modified로 응답합니다.
+
+    Args:
+        obj: 직렬화할 객체 (dict, list, numpy 배열 등)
+        status (int): HTTP 상태 코드
+        max_age (int): 지정 시 Cache-Control: public, max-age 헤더 추가
+
+    Returns:
+        Response: application/json 응답
+    """
+    body = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    response = Response(body, status=status, mimetype='application/json')
+
+    if status == 200:
+        response.set_etag(hashlib.blake2b(body, digest_size=16).hexdigest())
+        if max_age is not None:
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+        response.make_conditional(request)
+
+    return response
@@ -14,4 +14,4 @@ fi
 
 # 앱 시작
 echo "🌐 웹앱 시작..."
-python app.py
+exec gunicorn -c gunicorn_conf.py app:app
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+SectionStream 조기 중단 테스트
+
+실행: python -m unittest test_section_stream
+"""
+
+import unittest
+
+from financial_analyzer import TREND_HEADERS, TREND_HEADER_PATTERN, SectionStream
+
+
+TREND_BODY = """**📈 매출 성장 추이**
+매출이 꾸준히 증가했습니다.
+**💡 수익성 변화**
+영업이익률이 개선되었습니다.
+**🏗️ 자산 규모 변화**
+자산이 늘었습니다.
+**🎯 성장률 분석**
+연평균 10% 성장했습니다.
+**🔮 미래 전망**
+긍정적입니다.
+**📋 종합 평가**
+안정적인 성장세입니다.
+"""
+
+
+def collect(stream, chunks):
+    """조각들을 넣고 완성된 섹션을 dict로 반환"""
+    sections = []
+    for chunk in chunks:
+        sections.extend(stream.feed(chunk))
+    sections.extend(stream.close())
+    return dict(sections)
+
+
+class SectionStreamTest(unittest.TestCase):
+    def test_stop_line_with_trailing_text_in_same_chunk(self):
+        stream = SectionStream(TREND_HEADERS, TREND_HEADER_PATTERN)
+        sections = collect(stream, [TREND_BODY, '**📌 참고 사항**\n투자 권유가 아닙니다.\n뒤따르는 미완성 줄'])
+
+        self.assertTrue(stream.finished)
+        self.assertEqual(stream.text, TREND_BODY)
+        self.assertEqual(sections['overall_evaluation'], '안정적인 성장세입니다.\n')
+
+    def test_bold_subheading_in_last_section_does_not_stop(self):
+        body = TREND_BODY + '**긍정적 요소**\n현금 흐름이 좋습니다.\n**부정적 요소**\n부채가 늘었습니다.'
+        stream = SectionStream(TREND_HEADERS, TREND_HEADER_PATTERN)
+        sections = collect(stream, [body[:len(body) // 2], body[len(body) // 2:]])
+
+        self.assertFalse(stream.finished)
+        self.assertEqual(stream.text, body)
+        self.assertIn('**부정적 요소**\n부채가 늘었습니다.\n', sections['overall_evaluation'])
+
+    def test_no_early_stop(self):
+        body = TREND_BODY + '**📌 참고 사항**\n투자 권유가 아닙니다.'
+        stream = SectionStream(TREND_HEADERS, TREND_HEADER_PATTERN, early_stop=False)
+        collect(stream, [body])
+
+        self.assertFalse(stream.finished)
+        self.assertEqual(stream.text, body)
+
+
+if __name__ == '__main__':
+    unittest.main()